@@ -1,14 +1,81 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, make_response
+from werkzeug.security import generate_password_hash
+import hashlib
+import logging
 import sqlite3
 import os
+import json
+import time
 from datetime import datetime
+import db
+from create_hms_db import (
+    BILLING_TRIGGERS,
+    OPEN_BILL_UNIQUE_INDEX,
+    DASHBOARD_ROLLUP_SCHEMA,
+    DASHBOARD_ROLLUP_METRICS,
+    DOCTOR_TOUCH_TRIGGER,
+    DOCTOR_VIEWS,
+    DOCTOR_USERNAME_INDEX,
+    EXPECTED_TABLES,
+    HOT_PATH_INDEXES,
+    SCHEMA_VERSION,
+    seed_dashboard_rollup,
+)
+
+# --------------------------
+# Dashboard cache
+# --------------------------
+# The dashboard aggregates (counts, status breakdown, revenue, workload) are
+# read-heavy and change slowly, so cache them in-process for a short TTL and
+# clear the cache from the write paths that affect them.
+_DASHBOARD_CACHE_TTL = 60  # seconds
+_dashboard_cache = {}
+
+def _cache_get(key):
+    entry = _dashboard_cache.get(key)
+    if entry is not None and (time.time() - entry[1]) < _DASHBOARD_CACHE_TTL:
+        return entry[0]
+    return None
+
+def _cache_set(key, value):
+    _dashboard_cache[key] = (value, time.time())
+    return value
+
+def invalidate_dashboard_cache():
+    """Drop cached dashboard aggregates after a write that affects them."""
+    _dashboard_cache.clear()
+
+# --------------------------
+# Doctor dropdown cache
+# --------------------------
+# Nearly every admin page fetches the doctor_id/f_name/l_name list for a
+# select box, but it only changes when a doctor row changes — so keep it in
+# memory until add/edit/delete doctor invalidates it.
+_doctor_list_cache = {}
+
+def _doctor_list(conn, ordered=False):
+    key = 'ordered' if ordered else 'plain'
+    rows = _doctor_list_cache.get(key)
+    if rows is None:
+        sql = 'SELECT doctor_id, f_name, l_name FROM doctors'
+        if ordered:
+            sql += ' ORDER BY f_name, l_name'
+        rows = conn.execute(sql).fetchall()
+        _doctor_list_cache[key] = rows
+    return rows
+
+def invalidate_doctor_list():
+    """Drop the cached dropdown list after a doctor row changes."""
+    _doctor_list_cache.clear()
 
 # runtime migration guard: ensure bill_items has item-level paid columns
 _migrations_checked = False
 
-def ensure_bill_items_columns():
-    """Add 'paid' and 'paid_at' columns to bill_items if they don't exist yet.
-    This runs once per process to avoid SQL errors when selecting these columns.
+def ensure_schema():
+    """Bring an existing DB up to date: bill_items paid columns, hot-path
+    indexes, and the dashboard rollup. Runs once per process to avoid SQL
+    errors and full scans on the read paths; a DB already stamped with the
+    current user_version is skipped with a single integer compare.
     """
     global _migrations_checked
     if _migrations_checked:
@@ -17,6 +84,11 @@ def ensure_bill_items_columns():
         # open a short-lived connection for migration
         mconn = sqlite3.connect(DATABASE, timeout=30)
         cur = mconn.cursor()
+        try:
+            if cur.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+                return
+        except Exception:
+            pass
         try:
             cols = [r[1] for r in cur.execute("PRAGMA table_info(bill_items);").fetchall()]
         except Exception:
@@ -34,6 +106,82 @@ def ensure_bill_items_columns():
                 mconn.commit()
             except Exception:
                 pass
+        # normalize legacy NULLs so queries can test paid = 0 with an index
+        # equality seek instead of OR-ing in an IS NULL branch
+        try:
+            cur.execute("UPDATE bill_items SET paid = 0 WHERE paid IS NULL;")
+            mconn.commit()
+        except Exception:
+            pass
+        # indexes for the hot JOIN/GROUP BY columns used by bills/dashboard/
+        # appointments; IF NOT EXISTS makes this a no-op after the first run
+        try:
+            cur.executescript(HOT_PATH_INDEXES)
+            mconn.commit()
+        except Exception:
+            pass
+        # recreate the billing triggers so older DBs pick up current bodies
+        try:
+            cur.executescript(BILLING_TRIGGERS)
+            mconn.commit()
+        except Exception:
+            pass
+        # one open bill per patient; may fail on a DB that already violates
+        # the invariant, in which case the triggers still behave correctly
+        try:
+            cur.execute(OPEN_BILL_UNIQUE_INDEX)
+            mconn.commit()
+        except Exception:
+            pass
+        # stored username for the doctor login path; the unique index can
+        # fail on duplicate doctor names, login then falls back to a scan
+        try:
+            cols = [r[1] for r in cur.execute("PRAGMA table_info(doctors);").fetchall()]
+            if 'username' not in cols:
+                cur.execute("ALTER TABLE doctors ADD COLUMN username TEXT;")
+            cur.execute("UPDATE doctors SET username = f_name || l_name WHERE username IS NULL OR username = '';")
+            cur.execute(DOCTOR_USERNAME_INDEX)
+            mconn.commit()
+        except Exception:
+            pass
+        # updated_at stamp + touch trigger backing the doctor ETags
+        try:
+            cols = [r[1] for r in cur.execute("PRAGMA table_info(doctors);").fetchall()]
+            if 'updated_at' not in cols:
+                cur.execute("ALTER TABLE doctors ADD COLUMN updated_at TEXT;")
+                cur.execute("UPDATE doctors SET updated_at = COALESCE(created_at, datetime('now')) WHERE updated_at IS NULL;")
+            cur.execute(DOCTOR_TOUCH_TRIGGER)
+            mconn.commit()
+        except Exception:
+            pass
+        # named views over the treatment/appointment + patient joins
+        try:
+            cur.executescript(DOCTOR_VIEWS)
+            mconn.commit()
+        except Exception:
+            pass
+        # materialized dashboard aggregates: create the rollup table + triggers
+        # if this DB predates them, and reseed once per process so the values
+        # are authoritative even if the DB was modified without the triggers
+        try:
+            cur.executescript(DASHBOARD_ROLLUP_SCHEMA)
+            seed_dashboard_rollup(cur)
+            mconn.commit()
+        except Exception:
+            pass
+        # stamp the DB so future processes skip all of the above -- but only
+        # when the base schema is actually present. Every step above swallows
+        # its own errors, so on an empty DB (app started before
+        # create_hms_db.py ran) stamping here would trip create_hms_db's
+        # user_version fast path and leave the deployment without tables.
+        try:
+            existing = {r[0] for r in cur.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if EXPECTED_TABLES <= existing:
+                cur.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+                mconn.commit()
+        except Exception:
+            pass
     finally:
         try:
             mconn.close()
@@ -43,19 +191,29 @@ def ensure_bill_items_columns():
 
 admin_bp = Blueprint('admin', __name__)
 
+logger = logging.getLogger(__name__)
+
+# calendar event colors per appointment status (module-level so the
+# per-row lookup doesn't rebuild the dict on every iteration)
+STATUS_COLOR = {
+    'booked': '#FF9800',
+    'confirmed': '#4CAF50',
+    'cancelled': '#F44336',
+    'completed': '#2196F3',
+}
+
 # Use a path relative to this file so the app always finds the right DB
 DATABASE = os.path.join(os.path.dirname(__file__), 'hospital_management.db')
 
+def _now():
+    # canonical timestamp format for paid_at columns; computed once per
+    # request and shared by the write paths below
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
 def get_db_connection():
-    # increase timeout and allow connections from different threads (dev server may use threads)
-    conn = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    # ensure foreign keys are enabled on this connection
-    try:
-        conn.execute('PRAGMA foreign_keys = ON;')
-    except Exception:
-        pass
-    return conn
+    # request-scoped connection (see db.py); the app teardown closes it, so
+    # handlers no longer open/close a fresh connection per call
+    return db.get_db()
 
 # --------------------------
 # Admin Login / Logout
@@ -84,73 +242,196 @@ def logout():
     return redirect(url_for('admin.login'))  # <- added blueprint prefix
 
 
+# --------------------------
+# Canonical SQL statements
+# --------------------------
+# Kept as module constants so every request runs byte-identical SQL text and
+# hits the per-connection prepared-statement cache instead of re-parsing.
+SQL_ROLLUP_READ = 'SELECT metric, value FROM dashboard_rollup'
+
+SQL_APPT_AGGREGATES = '''
+        WITH appt AS MATERIALIZED (
+            SELECT doctor_id, appointment_datetime, status FROM appointments
+        )
+        SELECT 'status' AS kind, status AS label, COUNT(*) AS count
+        FROM appt GROUP BY status
+        UNION ALL
+        SELECT 'recent', DATE(appointment_datetime), COUNT(*)
+        FROM appt
+        WHERE appointment_datetime >= date('now', '-7 days')
+        GROUP BY DATE(appointment_datetime)
+        UNION ALL
+        SELECT 'workload', doctor_name, appointment_count FROM (
+            SELECT d.f_name || ' ' || d.l_name AS doctor_name,
+                   COUNT(a.doctor_id) AS appointment_count
+            FROM doctors d
+            LEFT JOIN appt a ON d.doctor_id = a.doctor_id
+            GROUP BY d.doctor_id
+            ORDER BY appointment_count DESC
+            LIMIT 5
+        )
+    '''
+
+SQL_PATIENTS_LIST = '''
+        SELECT p.id, p.first_name, p.last_name, p.dob, p.phone, p.address,
+               d.f_name || ' ' || d.l_name AS doctor_name
+        FROM patients p
+        LEFT JOIN doctors d ON d.doctor_id = p.doctor
+        ORDER BY p.id DESC
+    '''
+
+SQL_APPTS_LIST = '''
+        SELECT a.id, a.appointment_datetime, a.status, a.actions, a.notes, a.doctor_id,
+               p.first_name || ' ' || p.last_name AS patient_name, d.f_name || ' ' || d.l_name AS doctor_name
+        FROM appointments a
+        JOIN patients p ON p.id = a.patient_id
+        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+        ORDER BY a.appointment_datetime DESC
+    '''
+
+SQL_PATIENT_APPTS = '''
+        SELECT a.id, a.appointment_datetime, a.status, a.actions, a.doctor_id,
+               d.doctor_id AS assigned_doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
+        FROM appointments a
+        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+        WHERE a.patient_id = ?
+        ORDER BY a.appointment_datetime DESC
+    '''
+
+SQL_CALENDAR_APPTS = '''
+        SELECT
+            a.id,
+            a.appointment_datetime,
+            a.status,
+            a.notes,
+            p.first_name || ' ' || p.last_name AS patient_name,
+            d.f_name || ' ' || d.l_name AS doctor_name
+        FROM appointments a
+        JOIN patients p ON p.id = a.patient_id
+        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+        ORDER BY a.appointment_datetime
+    '''
+
+# cheap freshness probe for the bills page ETag: bill inserts/deletes move
+# the count, payments move a paid_at, and a new charge landing on an
+# existing open bill (the billing triggers' common case) moves
+# MAX(bill_items.created_at). Patient renames are accepted staleness — the
+# name column is cosmetic here and the stamp stays one cheap probe.
+SQL_BILLS_STAMP = '''
+        SELECT (SELECT COUNT(*) FROM bills),
+               (SELECT COALESCE(MAX(created_at), '') FROM bills),
+               (SELECT COALESCE(MAX(paid_at), '') FROM bills),
+               (SELECT COALESCE(MAX(paid_at), '') FROM bill_items),
+               (SELECT COALESCE(MAX(created_at), '') FROM bill_items)
+    '''
+
+SQL_BILLS_LIST = '''
+        SELECT b.id,
+               p.id AS patient_id,
+               p.first_name || ' ' || p.last_name AS patient_name,
+               b.total_amount,
+               b.paid,
+               b.paid_at,
+               b.created_at,
+               COALESCE(GROUP_CONCAT(bi.description, '; ') FILTER (WHERE bi.item_type = 'treatment'), '') AS treatments,
+               json_group_array(
+                   json_object('id', bi.id, 'description', bi.description, 'amount', bi.amount, 'paid', bi.paid)
+               ) FILTER (WHERE bi.item_type = 'treatment') AS items_json
+        FROM bills b
+        JOIN patients p ON p.id = b.patient_id
+        LEFT JOIN bill_items bi ON bi.bill_id = b.id
+        GROUP BY b.id
+        ORDER BY b.created_at DESC
+    '''
+
 # --------------------------
 # Admin Dashboard
 # --------------------------
-@admin_bp.route('/dashboard')
-def dashboard():
-    if 'admin' not in session:
-        return redirect(url_for('admin.login'))  # <- added blueprint prefix
+def _rollup_values(conn):
+    # Point-lookups against the trigger-maintained dashboard_rollup table
+    # instead of COUNT/SUM scans over the base tables.
+    values = {r['metric']: r['value'] for r in conn.execute(SQL_ROLLUP_READ).fetchall()}
+    if any(m not in values for m in DASHBOARD_ROLLUP_METRICS):
+        # older DB without the rollup rows yet: seed from the base tables
+        seed_dashboard_rollup(conn)
+        conn.commit()
+        values = {r['metric']: r['value'] for r in conn.execute(SQL_ROLLUP_READ).fetchall()}
+    return values
 
-    conn = get_db_connection()
-    
+
+def _stats(conn):
     # Basic stats
-    stats = {
-        'patients': conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0],
-        'doctors': conn.execute("SELECT COUNT(*) FROM doctors").fetchone()[0],
-        'bills': conn.execute('SELECT COUNT(*) FROM bills').fetchone()[0],
-        'appointments': conn.execute('SELECT COUNT(*) FROM appointments').fetchone()[0],
-    }
-    
+    cached = _cache_get('stats')
+    if cached is not None:
+        return cached
+    values = _rollup_values(conn)
+    return _cache_set('stats', {
+        'patients': values['patients'],
+        'doctors': values['doctors'],
+        'bills': values['bills'],
+        'appointments': values['appointments'],
+    })
+
+
+def _appt_aggregates(conn):
+    # Status breakdown, 7-day histogram and doctor workload all derive from
+    # the appointments table. A MATERIALIZED CTE (SQLite >= 3.35) lets one
+    # scan feed all three aggregations; rows come back tagged with a kind
+    # column and are split apart here.
+    cached = _cache_get('appt_aggregates')
+    if cached is not None:
+        return cached
+    rows = conn.execute(SQL_APPT_AGGREGATES).fetchall()
+    appt_stats = [{'status': r['label'], 'count': r['count']} for r in rows if r['kind'] == 'status']
+    recent = sorted(
+        ({'date': r['label'], 'count': r['count']} for r in rows if r['kind'] == 'recent'),
+        key=lambda r: r['date']
+    )
+    workload = [{'doctor_name': r['label'], 'appointment_count': r['count']} for r in rows if r['kind'] == 'workload']
+    return _cache_set('appt_aggregates', (appt_stats, recent, workload))
+
+
+def _appt_stats(conn):
     # Appointment status breakdown
-    appointment_stats = conn.execute('''
-        SELECT status, COUNT(*) as count 
-        FROM appointments 
-        GROUP BY status
-    ''').fetchall()
-    
+    return _appt_aggregates(conn)[0]
+
+
+def _recent_appts(conn):
     # Recent appointments (last 7 days)
-    recent_appointments = conn.execute('''
-        SELECT DATE(appointment_datetime) as date, COUNT(*) as count
-        FROM appointments
-        WHERE appointment_datetime >= date('now', '-7 days')
-        GROUP BY DATE(appointment_datetime)
-        ORDER BY date
-    ''').fetchall()
-    
+    return _appt_aggregates(conn)[1]
+
+
+def _revenue(conn):
     # Revenue stats
-    revenue_stats = conn.execute('''
-        SELECT 
-            SUM(CASE WHEN paid = 1 THEN total_amount ELSE 0 END) as paid_amount,
-            SUM(CASE WHEN paid = 0 THEN total_amount ELSE 0 END) as pending_amount,
-            SUM(total_amount) as total_amount
-        FROM bills
-    ''').fetchone()
-    
+    cached = _cache_get('revenue')
+    if cached is not None:
+        return cached
+    values = _rollup_values(conn)
+    return _cache_set('revenue', {
+        'paid_amount': values['revenue_paid'],
+        'pending_amount': values['revenue_pending'],
+        'total_amount': values['revenue_total'],
+    })
+
+
+def _doctor_workload(conn):
     # Doctor workload (appointment count per doctor)
-    doctor_workload = conn.execute('''
-        SELECT 
-            d.f_name || ' ' || d.l_name as doctor_name,
-            COUNT(a.id) as appointment_count
-        FROM doctors d
-        LEFT JOIN appointments a ON d.doctor_id = a.doctor_id
-        GROUP BY d.doctor_id
-        ORDER BY appointment_count DESC
-        LIMIT 5
-    ''').fetchall()
-    
-    conn.close()
-    
-    # Debug logging
-    print(f"📊 Dashboard Data:")
-    print(f"   Stats: {stats}")
-    print(f"   Appointment Stats: {len(appointment_stats)} rows")
-    print(f"   Recent Appointments: {len(recent_appointments)} rows")
-    print(f"   Doctor Workload: {len(doctor_workload)} rows")
-    if len(recent_appointments) > 0:
-        print(f"   Sample recent: {dict(recent_appointments[0])}")
-    if len(appointment_stats) > 0:
-        print(f"   Sample stats: {dict(appointment_stats[0])}")
+    return _appt_aggregates(conn)[2]
+
+
+@admin_bp.route('/dashboard')
+def dashboard():
+    if 'admin' not in session:
+        return redirect(url_for('admin.login'))  # <- added blueprint prefix
+    conn = get_db_connection()
+    stats = _stats(conn)
+    appointment_stats = _appt_stats(conn)
+    recent_appointments = _recent_appts(conn)
+    revenue_stats = _revenue(conn)
+    doctor_workload = _doctor_workload(conn)
+
+    logger.debug('dashboard: stats=%s appt_stats=%d recent=%d workload=%d',
+                 stats, len(appointment_stats), len(recent_appointments), len(doctor_workload))
     
     return render_template('dashboard.html', 
                          stats=stats,
@@ -168,27 +449,20 @@ def patients():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))  # <- added blueprint prefix
     conn = get_db_connection()
-    patients = conn.execute('''
-        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name
-        FROM patients p
-        LEFT JOIN doctors d ON d.doctor_id = p.doctor
-        ORDER BY p.id DESC
-    ''').fetchall()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
-    conn.close()
+    patients = conn.execute(SQL_PATIENTS_LIST).fetchall()
+    doctors = _doctor_list(conn)
     
-    # Convert Row objects to dictionaries and format DOB to mm-dd-yyyy
+    # Convert Row objects to dictionaries and format DOB to mm-dd-yyyy.
+    # The stored value is ISO yyyy-mm-dd, so slicing beats strptime/strftime
+    # by a couple of orders of magnitude per row.
     patients_list = []
     for p in patients:
         patient_dict = dict(p)
-        if patient_dict.get('dob'):
-            try:
-                dob_obj = datetime.strptime(patient_dict['dob'], '%Y-%m-%d')
-                patient_dict['dob_formatted'] = dob_obj.strftime('%m-%d-%Y')
-            except:
-                patient_dict['dob_formatted'] = patient_dict['dob']
+        dob = patient_dict.get('dob')
+        if dob and len(dob) >= 10:
+            patient_dict['dob_formatted'] = f"{dob[5:7]}-{dob[8:10]}-{dob[0:4]}"
         else:
-            patient_dict['dob_formatted'] = None
+            patient_dict['dob_formatted'] = dob or None
         patients_list.append(patient_dict)
     
     return render_template('add_patient.html', patients=patients_list, doctors=doctors)
@@ -212,14 +486,13 @@ def add_patient():
             (first, last, dob, phone, address, doctor)
         )
         conn.commit()
-        conn.close()
+        invalidate_dashboard_cache()
         flash('Patient added successfully!', 'success')
         return redirect(url_for('admin.patients'))  # <- added blueprint prefix
 
     # GET: provide list of doctors for the select
     conn = get_db_connection()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
-    conn.close()
+    doctors = _doctor_list(conn)
     return render_template('add_patients.html', doctors=doctors)
 
 
@@ -230,7 +503,7 @@ def delete_patient(pid):
     conn = get_db_connection()
     conn.execute('DELETE FROM patients WHERE id = ?', (pid,))
     conn.commit()
-    conn.close()
+    invalidate_dashboard_cache()
     flash('Patient deleted successfully!', 'info')
     return redirect(url_for('admin.patients'))  # <- added blueprint prefix
 
@@ -242,93 +515,83 @@ def delete_patient(pid):
 def bills():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))  # <- added blueprint prefix
-    ensure_bill_items_columns()
     conn = get_db_connection()
-    bills = conn.execute('''
-        SELECT b.id,
-               p.id AS patient_id,
-               p.first_name || ' ' || p.last_name AS patient_name,
-               b.total_amount,
-               b.paid,
-               b.paid_at,
-               b.created_at,
-               COALESCE(GROUP_CONCAT(CASE WHEN bi.item_type = 'treatment' THEN bi.description END, '; '), '') AS treatments
-        FROM bills b
-        JOIN patients p ON p.id = b.patient_id
-        LEFT JOIN bill_items bi ON bi.bill_id = b.id
-        GROUP BY b.id
-        ORDER BY b.created_at DESC
-    ''').fetchall()
-    # fetch treatment items per bill so template can provide a selectable list
-    bill_ids = [str(row['id']) for row in bills]
+    # conditional GET: hash a cheap freshness stamp and answer 304 before
+    # running the aggregate query or rendering when nothing changed
+    stamp = conn.execute(SQL_BILLS_STAMP).fetchone()
+    etag = hashlib.md5('|'.join(str(v) for v in stamp).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        return resp
+    # one pass over bills + bill_items: the treatment items come back inline
+    # as a JSON array per bill, replacing the second IN (...) round-trip
+    bills = conn.execute(SQL_BILLS_LIST).fetchall()
+    # treatment items per bill so template can provide a selectable list;
+    # the FILTER clause already excludes non-treatment rows in SQL
     bill_items_map = {}
-    if bill_ids:
-        q = f"SELECT id, bill_id, item_type, description, amount, paid FROM bill_items WHERE bill_id IN ({','.join(bill_ids)}) AND item_type = 'treatment' ORDER BY created_at DESC"
-        items = conn.execute(q).fetchall()
-        for it in items:
-            bill_items_map.setdefault(it['bill_id'], []).append(dict(id=it['id'], description=it['description'], amount=it['amount'], paid=it['paid']))
-    conn.close()
-    return render_template('bills.html', bills=bills, bill_items_map=bill_items_map)
+    for row in bills:
+        items = json.loads(row['items_json']) if row['items_json'] else []
+        if items:
+            bill_items_map[row['id']] = items
+    resp = make_response(render_template('bills.html', bills=bills, bill_items_map=bill_items_map))
+    resp.set_etag(etag)
+    # admin-only page: allow revalidation but never shared caching
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
 
 
 @admin_bp.route('/payments', methods=['POST'])
 def payments():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
-    ensure_bill_items_columns()
     # expected form data: selected_bill (multiple) and for each bill a selected_treatment_<billid>
     selected = request.form.getlist('selected_bill')
     if not selected:
         flash('No bills selected for payment.', 'warning')
         return redirect(url_for('admin.bills'))
 
-    # collect selected treatment item ids and associated bill/patient info
-    conn = get_db_connection()
-    item_ids = []
-    bills_info = {}
-    patient_ids = set()
-    for bid in selected:
-        sel_name = f'selected_treatment_{bid}'
-        # support multiple selections per bill
-        item_vals = request.form.getlist(sel_name)
-        for item_id in item_vals:
-            if not item_id:
-                continue
-            try:
-                iid = int(item_id)
-            except Exception:
-                continue
-            # skip items already paid
-            paid_row = conn.execute('SELECT paid FROM bill_items WHERE id = ?', (iid,)).fetchone()
-            if paid_row and paid_row['paid']:
-                # ignore already-paid items
-                continue
-            item_ids.append(iid)
-            row = conn.execute('SELECT bill_id FROM bill_items WHERE id = ?', (iid,)).fetchone()
-            if row:
-                b_id = row['bill_id']
-                b = conn.execute('SELECT id, patient_id, total_amount, paid FROM bills WHERE id = ?', (b_id,)).fetchone()
-                if b:
-                    bills_info.setdefault(b_id, dict(id=b['id'], patient_id=b['patient_id'], total_amount=b['total_amount'], paid=b['paid']))
-                    patient_ids.add(b['patient_id'])
+    # collect selected treatment item ids up front: drop non-numeric values
+    # and dedupe so repeated form fields don't inflate the IN (...) list.
+    # removeprefix strips at most one '-', so anything passing isdecimal()
+    # is guaranteed to parse with int()
+    item_ids = list({
+        int(x)
+        for bid in selected
+        for x in request.form.getlist(f'selected_treatment_{bid}')
+        if x and x.removeprefix('-').isdecimal()
+    })
 
     if not item_ids:
         flash('No treatment items selected for payment.', 'warning')
-        conn.close()
         return redirect(url_for('admin.bills'))
 
-    # fetch item details
+    # one JOIN returns item, bill and patient together and filters out
+    # already-paid items — replaces the 3-queries-per-item loop
+    conn = get_db_connection()
     placeholders = ','.join('?' for _ in item_ids)
-    items = conn.execute(f'SELECT id, bill_id, description, amount FROM bill_items WHERE id IN ({placeholders})', item_ids).fetchall()
-    items = [dict(id=i['id'], bill_id=i['bill_id'], description=i['description'], amount=i['amount']) for i in items]
-    # determine patient(s)
-    patients = {}
-    for b in bills_info.values():
-        p = conn.execute('SELECT id, first_name, last_name FROM patients WHERE id = ?', (b['patient_id'],)).fetchone()
-        if p:
-            patients[b['patient_id']] = dict(id=p['id'], name=f"{p['first_name']} {p['last_name']}")
+    rows = conn.execute(f'''
+        SELECT bi.id, bi.bill_id, bi.description, bi.amount,
+               b.patient_id, b.total_amount, b.paid AS bill_paid,
+               p.first_name, p.last_name
+        FROM bill_items bi
+        JOIN bills b ON b.id = bi.bill_id
+        JOIN patients p ON p.id = b.patient_id
+        WHERE bi.id IN ({placeholders}) AND bi.paid = 0
+    ''', item_ids).fetchall()
 
-    conn.close()
+    if not rows:
+        flash('No treatment items selected for payment.', 'warning')
+        return redirect(url_for('admin.bills'))
+
+    items = []
+    bills_info = {}
+    patients = {}
+    for r in rows:
+        items.append(dict(id=r['id'], bill_id=r['bill_id'], description=r['description'], amount=r['amount']))
+        bills_info.setdefault(r['bill_id'], dict(id=r['bill_id'], patient_id=r['patient_id'], total_amount=r['total_amount'], paid=r['bill_paid']))
+        patients[r['patient_id']] = dict(id=r['patient_id'], name=f"{r['first_name']} {r['last_name']}")
+    patient_ids = set(patients)
 
     return render_template('payment_portal.html', items=items, bills_info=bills_info, patients=patients, patient_ids=list(patient_ids))
 
@@ -337,38 +600,42 @@ def payments():
 def payments_process():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
-    ensure_bill_items_columns()
-    # expects 'item_ids' as multiple values
-    item_ids = request.form.getlist('item_ids')
+    # expects 'item_ids' as multiple values; dedupe and drop non-numeric
+    # values so the same item can't be updated twice in one submission
+    item_ids = list({int(x) for x in request.form.getlist('item_ids') if x and x.removeprefix('-').isdecimal()})
     payment_method = request.form.get('payment_method') or 'unknown'
-    # normalize to ints
-    try:
-        item_ids = [int(x) for x in item_ids]
-    except Exception:
-        item_ids = []
     if not item_ids:
         flash('No items to process.', 'warning')
         return redirect(url_for('admin.bills'))
 
     conn = get_db_connection()
-    # mark each selected item as paid and set paid_at
+    # run all item/bill updates in one write transaction: one fsync at commit
+    # and the writer lock is taken up front instead of per statement
+    conn.execute('BEGIN IMMEDIATE')
+    # mark every selected unpaid item in one batched UPDATE; RETURNING hands
+    # back the affected bill ids without a separate SELECT
     placeholders = ','.join('?' for _ in item_ids)
-    items = conn.execute(f'SELECT id, bill_id, amount FROM bill_items WHERE id IN ({placeholders})', item_ids).fetchall()
-    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    paid_bill_ids = set()
-    for it in items:
-        conn.execute('UPDATE bill_items SET paid = 1, paid_at = ? WHERE id = ? AND (paid IS NULL OR paid = 0)', (now, it['id']))
-        paid_bill_ids.add(it['bill_id'])
-
-    # For each affected bill, check if all items are paid; if so, mark bill as paid and set paid_at
-    for bid in paid_bill_ids:
-        row = conn.execute('SELECT SUM(CASE WHEN paid = 0 OR paid IS NULL THEN 1 ELSE 0 END) AS unpaid_count FROM bill_items WHERE bill_id = ?', (bid,)).fetchone()
-        unpaid = row['unpaid_count'] if row else 0
-        if unpaid == 0:
-            conn.execute('UPDATE bills SET paid = 1, paid_at = ? WHERE id = ?', (now, bid))
+    now = _now()
+    paid_bill_ids = {r['bill_id'] for r in conn.execute(
+        f'UPDATE bill_items SET paid = 1, paid_at = ? WHERE id IN ({placeholders}) AND paid = 0 RETURNING bill_id',
+        [now, *item_ids]
+    ).fetchall()}
+
+    # Mark every affected bill whose items are now all paid, in one set-based
+    # statement instead of a SELECT + UPDATE pair per bill
+    if paid_bill_ids:
+        bill_placeholders = ','.join('?' for _ in paid_bill_ids)
+        conn.execute(f'''
+            UPDATE bills SET paid = 1, paid_at = ?
+            WHERE id IN ({bill_placeholders})
+              AND NOT EXISTS (
+                  SELECT 1 FROM bill_items bi
+                  WHERE bi.bill_id = bills.id AND bi.paid = 0
+              )
+        ''', [now, *paid_bill_ids])
 
     conn.commit()
-    conn.close()
+    invalidate_dashboard_cache()
     flash(f'Payment processed ({payment_method}) for selected items. Item-level payment recorded.', 'success')
     return redirect(url_for('admin.bills'))
 
@@ -378,19 +645,18 @@ def payments_process():
 def mark_bill_paid(bid):
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
-    ensure_bill_items_columns()
     conn = get_db_connection()
-    row = conn.execute('SELECT paid FROM bills WHERE id = ?', (bid,)).fetchone()
-    if not row:
-        conn.close()
-        return ('Bill not found', 404)
-    if row['paid']:
-        conn.close()
-        return ('Already paid', 400)
-    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    conn.execute('UPDATE bills SET paid = 1, paid_at = ? WHERE id = ?', (now, bid))
+    # single idempotent UPDATE: only flips an unpaid bill, so the happy path
+    # is one statement instead of SELECT -> branch -> UPDATE
+    now = _now()
+    cur = conn.execute('UPDATE bills SET paid = 1, paid_at = ? WHERE id = ? AND paid = 0', (now, bid))
     conn.commit()
-    conn.close()
+    if cur.rowcount == 0:
+        # nothing changed: cheap lookup only on this cold path to pick the status
+        if conn.execute('SELECT 1 FROM bills WHERE id = ?', (bid,)).fetchone() is None:
+            return ('Bill not found', 404)
+        return ('Already paid', 400)
+    invalidate_dashboard_cache()
     return ('', 204)
 
 
@@ -402,8 +668,10 @@ def doctors():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
     conn = get_db_connection()
-    doctors = conn.execute("SELECT * FROM doctors ORDER BY created_at DESC").fetchall()
-    conn.close()
+    doctors = conn.execute(
+        "SELECT doctor_id, f_name, l_name, specialization, contact, department, availability "
+        "FROM doctors ORDER BY created_at DESC"
+    ).fetchall()
     return render_template('doctors.html', doctors=doctors)
 
 
@@ -419,14 +687,30 @@ def add_doctor():
         department = request.form.get('department')
         availability = request.form.get('availability')
 
-        password = request.form.get('password')
+        # stored hashed from the start; doctor login verifies the hash
+        password = generate_password_hash(request.form.get('password') or '')
+        # mirror the migration backfill (f_name || l_name) so new doctors hit
+        # the ux_doctors_username indexed login path instead of the name scan
+        username = (f_name or '') + (l_name or '')
         conn = get_db_connection()
-        conn.execute(
-            "INSERT INTO doctors (f_name, l_name, specialization, contact, department, availability, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (f_name, l_name, specialization, contact, department, availability, password)
-        )
+        try:
+            # updated_at is set explicitly: on a migrated DB the column was
+            # ALTERed in without a default, and the roster ETag stamp relies
+            # on it moving with the row
+            conn.execute(
+                "INSERT INTO doctors (f_name, l_name, username, specialization, contact, department, availability, password, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                (f_name, l_name, username, specialization, contact, department, availability, password)
+            )
+        except (sqlite3.IntegrityError, sqlite3.OperationalError):
+            # duplicate name (unique index) or pre-migration DB without the
+            # column: store the row anyway; login falls back to the name scan
+            conn.execute(
+                "INSERT INTO doctors (f_name, l_name, specialization, contact, department, availability, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (f_name, l_name, specialization, contact, department, availability, password)
+            )
         conn.commit()
-        conn.close()
+        invalidate_dashboard_cache()
+        invalidate_doctor_list()
         flash('Doctor added successfully!', 'success')
         return redirect(url_for('admin.doctors'))
     
@@ -449,27 +733,41 @@ def edit_doctor(did):
         availability = request.form.get('availability')
         password = request.form.get('password')
         
+        # keep the login username in sync with a rename (same f_name ||
+        # l_name shape as add_doctor and the migration backfill)
+        username = (f_name or '') + (l_name or '')
         if password:
-            # Update with new password
-            conn.execute(
-                "UPDATE doctors SET f_name=?, l_name=?, specialization=?, contact=?, department=?, availability=?, password=? WHERE doctor_id=?",
-                (f_name, l_name, specialization, contact, department, availability, password, did)
-            )
+            # Update with new password, stored hashed like the login upgrade
+            try:
+                conn.execute(
+                    "UPDATE doctors SET f_name=?, l_name=?, username=?, specialization=?, contact=?, department=?, availability=?, password=? WHERE doctor_id=?",
+                    (f_name, l_name, username, specialization, contact, department, availability, generate_password_hash(password), did)
+                )
+            except (sqlite3.IntegrityError, sqlite3.OperationalError):
+                conn.execute(
+                    "UPDATE doctors SET f_name=?, l_name=?, specialization=?, contact=?, department=?, availability=?, password=? WHERE doctor_id=?",
+                    (f_name, l_name, specialization, contact, department, availability, generate_password_hash(password), did)
+                )
         else:
             # Update without changing password
-            conn.execute(
-                "UPDATE doctors SET f_name=?, l_name=?, specialization=?, contact=?, department=?, availability=? WHERE doctor_id=?",
-                (f_name, l_name, specialization, contact, department, availability, did)
-            )
+            try:
+                conn.execute(
+                    "UPDATE doctors SET f_name=?, l_name=?, username=?, specialization=?, contact=?, department=?, availability=? WHERE doctor_id=?",
+                    (f_name, l_name, username, specialization, contact, department, availability, did)
+                )
+            except (sqlite3.IntegrityError, sqlite3.OperationalError):
+                conn.execute(
+                    "UPDATE doctors SET f_name=?, l_name=?, specialization=?, contact=?, department=?, availability=? WHERE doctor_id=?",
+                    (f_name, l_name, specialization, contact, department, availability, did)
+                )
         
         conn.commit()
-        conn.close()
+        invalidate_doctor_list()
         flash('Doctor details updated successfully!', 'success')
         return redirect(url_for('admin.doctors'))
     
     # GET request - fetch doctor details
     doctor = conn.execute("SELECT * FROM doctors WHERE doctor_id = ?", (did,)).fetchone()
-    conn.close()
     
     if not doctor:
         flash('Doctor not found!', 'error')
@@ -485,7 +783,8 @@ def delete_doctor(did):
     conn = get_db_connection()
     conn.execute("DELETE FROM doctors WHERE doctor_id = ?", (did,))
     conn.commit()
-    conn.close()
+    invalidate_dashboard_cache()
+    invalidate_doctor_list()
     flash('Doctor deleted successfully!', 'info')
     return redirect(url_for('admin.doctors'))
 
@@ -498,17 +797,14 @@ def update_patient(pid):
         return redirect(url_for('admin.login'))
 
     conn = get_db_connection()
-    patient = conn.execute('SELECT * FROM patients WHERE id = ?', (pid,)).fetchone()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
+    patient = conn.execute(
+        'SELECT id, first_name, last_name, dob, phone, address, doctor FROM patients WHERE id = ?',
+        (pid,)
+    ).fetchone()
+    doctors = _doctor_list(conn)
     # fetch appointments for this patient so admin can edit time/status
     # include doctor info (if assigned) so template can show current assigned doctor name
-    appointments = conn.execute('''
-        SELECT a.*, d.doctor_id AS assigned_doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
-        FROM appointments a
-        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
-        WHERE a.patient_id = ?
-        ORDER BY a.appointment_datetime DESC
-    ''', (pid,)).fetchall()
+    appointments = conn.execute(SQL_PATIENT_APPTS, (pid,)).fetchall()
 
     if request.method == 'POST':
         first = request.form['first_name']
@@ -530,25 +826,25 @@ def update_patient(pid):
                 except Exception:
                     doctor = doctor_raw
 
+        conn.execute('BEGIN IMMEDIATE')
         conn.execute(
             'UPDATE patients SET first_name=?, last_name=?, dob=?, phone=?, address=?, doctor=? WHERE id=?',
             (first, last, dob, phone, address, doctor, pid)
         )
         conn.commit()
-        # resolve doctor name for flash
+        # resolve doctor name for flash from the already-fetched dropdown
+        # rows instead of an extra SELECT
         doc_name = None
         if doctor:
-            row = conn.execute('SELECT f_name, l_name FROM doctors WHERE doctor_id = ?', (doctor,)).fetchone()
-            if row:
-                doc_name = f"Dr. {row['f_name']} {row['l_name']}"
-        conn.close()
+            for d in doctors:
+                if d['doctor_id'] == doctor:
+                    doc_name = f"Dr. {d['f_name']} {d['l_name']}"
+                    break
         if doc_name:
             flash(f'Patient updated and assigned to {doc_name}', 'success')
         else:
             flash('Patient updated successfully!', 'success')
         return redirect(url_for('admin.patients'))
-
-    conn.close()
     return render_template('update_patient.html', patient=patient, doctors=doctors, appointments=appointments)
 
 
@@ -577,11 +873,11 @@ def update_appointment(aid):
     if date and time:
         appt_dt = f"{date} {time}"
 
-    # debug print for tracing what is being updated
-    print(f"[admin.update_appointment] FORM DATA: {dict(request.form)}")
-    print(f"[admin.update_appointment] aid={aid} patient_id={patient_id!r} appt_dt={appt_dt!r} status={status!r} actions={actions!r} doctor_id={doctor_id!r}")
+    logger.debug('update_appointment: aid=%s patient_id=%r appt_dt=%r status=%r actions=%r doctor_id=%r',
+                 aid, patient_id, appt_dt, status, actions, doctor_id)
 
     conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
     # update appointment fields: actions, optionally datetime, status, and per-appointment doctor assignment
     if appt_dt:
         if doctor_id is not None:
@@ -594,10 +890,6 @@ def update_appointment(aid):
         else:
             conn.execute('UPDATE appointments SET status = ?, actions = ? WHERE id = ?', (status, actions, aid))
     conn.commit()
-    # verify update
-    row = conn.execute('SELECT id, doctor_id, status, appointment_datetime, actions FROM appointments WHERE id = ?', (aid,)).fetchone()
-    print(f"[admin.update_appointment] post-update row={row}")
-    conn.close()
     flash('Appointment updated', 'success')
     if patient_id:
         return redirect(url_for('admin.update_patient', pid=patient_id))
@@ -610,15 +902,8 @@ def appointments():
         return redirect(url_for('admin.login'))
     conn = get_db_connection()
     # show ALL appointments so admin can see everything
-    rows = conn.execute('''
-        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name, d.doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
-        FROM appointments a
-        JOIN patients p ON p.id = a.patient_id
-        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
-        ORDER BY a.appointment_datetime DESC
-    ''').fetchall()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors ORDER BY f_name, l_name').fetchall()
-    conn.close()
+    rows = conn.execute(SQL_APPTS_LIST).fetchall()
+    doctors = _doctor_list(conn, ordered=True)
     return render_template('admin_appointments.html', rows=rows, doctors=doctors)
 
 
@@ -628,46 +913,24 @@ def appointments_calendar():
         return redirect(url_for('admin.login'))
     conn = get_db_connection()
     # Get all appointments for calendar
-    appointments = conn.execute('''
-        SELECT 
-            a.id,
-            a.appointment_datetime,
-            a.status,
-            a.notes,
-            p.first_name || ' ' || p.last_name AS patient_name,
-            d.f_name || ' ' || d.l_name AS doctor_name
-        FROM appointments a
-        JOIN patients p ON p.id = a.patient_id
-        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
-        ORDER BY a.appointment_datetime
-    ''').fetchall()
+    appointments = conn.execute(SQL_CALENDAR_APPTS).fetchall()
     
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors ORDER BY f_name, l_name').fetchall()
-    conn.close()
+    doctors = _doctor_list(conn, ordered=True)
     
     # Convert to list of dicts for JSON serialization
-    events = []
-    for appt in appointments:
-        color = {
-            'booked': '#FF9800',
-            'confirmed': '#4CAF50',
-            'cancelled': '#F44336',
-            'completed': '#2196F3'
-        }.get(appt['status'], '#999999')
-        
-        events.append({
-            'id': appt['id'],
-            'title': f"{appt['patient_name']} - {appt['doctor_name'] or 'No Doctor'}",
-            'start': appt['appointment_datetime'],
-            'color': color,
-            'extendedProps': {
-                'patient': appt['patient_name'],
-                'doctor': appt['doctor_name'] or 'Not assigned',
-                'status': appt['status'],
-                'notes': appt['notes'] or ''
-            }
-        })
-    
+    events = [{
+        'id': appt['id'],
+        'title': f"{appt['patient_name']} - {appt['doctor_name'] or 'No Doctor'}",
+        'start': appt['appointment_datetime'],
+        'color': STATUS_COLOR.get(appt['status'], '#999999'),
+        'extendedProps': {
+            'patient': appt['patient_name'],
+            'doctor': appt['doctor_name'] or 'Not assigned',
+            'status': appt['status'],
+            'notes': appt['notes'] or ''
+        }
+    } for appt in appointments]
+
     return render_template('admin_appointments_calendar.html', events=events, doctors=doctors)
 
 
@@ -699,25 +962,25 @@ def confirm_appointment(aid):
         if time:
             appt_dt = f"{date} {time}"
 
-    # debug log to help trace why doctor_id may not be set
-    print(f"[admin.confirm_appointment] aid={aid} doctor_id={doctor_id!r} status={status!r} edit_dt={edit_dt!r} date={date!r} time={time!r} actions={actions!r}")
+    logger.debug('confirm_appointment: aid=%s doctor_id=%r status=%r edit_dt=%r date=%r time=%r actions=%r',
+                 aid, doctor_id, status, edit_dt, date, time, actions)
     # require a doctor selection unless cancelling
     if doctor_id is None and status != 'cancelled':
         flash('Please select a doctor before confirming or completing.', 'danger')
         return redirect(url_for('admin.appointments'))
 
     conn = get_db_connection()
-    # build update fields dynamically
+    conn.execute('BEGIN IMMEDIATE')
+    # build update fields dynamically; RETURNING hands back the freshly
+    # written row so no verification SELECT is needed (SQLite 3.35+)
     if appt_dt is not None:
-        conn.execute('UPDATE appointments SET doctor_id = ?, status = ?, appointment_datetime = ?, actions = ? WHERE id = ?', (doctor_id, status, appt_dt, actions, aid))
+        row = conn.execute('UPDATE appointments SET doctor_id = ?, status = ?, appointment_datetime = ?, actions = ? WHERE id = ? RETURNING id, doctor_id, status, appointment_datetime, actions', (doctor_id, status, appt_dt, actions, aid)).fetchone()
     else:
-        conn.execute('UPDATE appointments SET doctor_id = ?, status = ?, actions = ? WHERE id = ?', (doctor_id, status, actions, aid))
+        row = conn.execute('UPDATE appointments SET doctor_id = ?, status = ?, actions = ? WHERE id = ? RETURNING id, doctor_id, status, appointment_datetime, actions', (doctor_id, status, actions, aid)).fetchone()
 
     conn.commit()
-    # verify update: fetch appointment row and confirm doctor_id
-    row = conn.execute('SELECT id, doctor_id, status, appointment_datetime, actions FROM appointments WHERE id = ?', (aid,)).fetchone()
-    conn.close()
-    print(f"[admin.confirm_appointment] post-update row={row}")
+    invalidate_dashboard_cache()
+    logger.debug('confirm_appointment: post-update row=%s', row)
     if not row:
         flash('Failed to update appointment — please check logs.', 'danger')
     elif row['status'] == 'cancelled':
@@ -1,4 +1,5 @@
-from flask import Flask
+from flask import Flask, redirect, url_for
+import db
 from admin_routes import admin_bp
 from patient_routes import patient_bp
 from doctor_routes import doctor_bp
@@ -12,6 +13,29 @@ import os
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
 
+# close the request-scoped DB connection when the app context tears down
+db.init_app(app)
+
+# Optional server-side sessions in Redis. The default (itsdangerous-signed
+# cookies) works fine for a single process, but when running several app
+# instances set SESSION_REDIS_URL to share sessions via Redis instead of
+# shipping them in cookies. Requires Flask-Session + redis to be installed.
+_redis_url = os.environ.get('SESSION_REDIS_URL')
+if _redis_url:
+    try:
+        import redis
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.from_url(_redis_url)
+        app.config['SESSION_USE_SIGNER'] = True
+        Session(app)
+    except Exception as e:
+        print('Redis session store not enabled:', e)
+
+# bring the DB schema up to date once at startup instead of re-checking a
+# module flag on every bills/payments request
+admin_mod.ensure_schema()
+
 app.register_blueprint(admin_bp, url_prefix='/admin')
 app.register_blueprint(patient_bp, url_prefix='/patient')
 app.register_blueprint(doctor_bp, url_prefix='/doctor')
@@ -20,7 +44,6 @@ app.register_blueprint(doctor_bp, url_prefix='/doctor')
 @app.route('/')
 def index():
     # default landing: redirect to admin login
-    from flask import redirect, url_for
     return redirect(url_for('admin.login'))
 
 def _log_db_paths():
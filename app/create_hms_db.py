@@ -1,19 +1,148 @@
 import sqlite3
+import sys
 
-def create_hms_db(db_name="hospital_management.db"):
-    conn = sqlite3.connect(db_name)
-    c = conn.cursor()
+# Schema version stamped into PRAGMA user_version after a successful
+# bootstrap/migration pass; both this script and the runtime migration in
+# admin_routes skip all work when the stamp is current. Bump on every new
+# migration step.
+# v2: foreign-key covering indexes added to HOT_PATH_INDEXES
+# v3: billing trigger bodies updated (open bill addressed by patient_id+paid)
+# v4: partial unique index enforcing one open bill per patient
+# v5: triggers rely on created_at column defaults instead of datetime('now')
+# v6: billing triggers generated from one template (NULL-patient guard added)
+# v7: composite (fk, date) indexes for the doctor views replace four
+#     single-column FK indexes
+# v8: doctors.username column (backfilled from f_name||l_name) + unique index
+# v9: appointments(doctor_id, patient_id) index for the doctor patient lists
+# v10: doctors.updated_at column + touch trigger (ETag stamps for the roster
+#      and profile pages)
+# v11: named views over the treatment/appointment + patient-name joins
+SCHEMA_VERSION = 11
 
-    # Enable foreign keys
-    c.execute("PRAGMA foreign_keys = ON;")
-    # Use WAL journal mode to reduce locking contention (allows concurrent reads/writes)
-    try:
-        c.execute("PRAGMA journal_mode = WAL;")
-        c.execute("PRAGMA synchronous = NORMAL;")
-    except Exception:
-        pass
+# One-time capability probe of the linked SQLite library; the DDL constants
+# below are shaped for the fastest variant this engine supports instead of
+# the lowest common denominator. Computed once at import, reused every call.
+SQLITE_VER = sqlite3.sqlite_version_info
+HAS_STRICT = SQLITE_VER >= (3, 37, 0)
+HAS_PARTIAL_IDX = SQLITE_VER >= (3, 8, 0)
+
+# -----------------------
+# dashboard rollup (materialized aggregates)
+# -----------------------
+# The admin dashboard reads its headline numbers (entity counts, revenue)
+# from this table instead of re-scanning patients/doctors/bills/appointments
+# on every hit. Triggers keep the values current on any write path.
+# Module-level so the runtime migration in admin_routes can reuse it.
+DASHBOARD_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dashboard_rollup (
+    metric TEXT PRIMARY KEY,
+    value NUMERIC DEFAULT 0,
+    updated_at TEXT
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_patients_ai AFTER INSERT ON patients
+BEGIN
+    UPDATE dashboard_rollup SET value = value + 1, updated_at = datetime('now') WHERE metric = 'patients';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_patients_ad AFTER DELETE ON patients
+BEGIN
+    UPDATE dashboard_rollup SET value = value - 1, updated_at = datetime('now') WHERE metric = 'patients';
+END;
 
-    schema = """
+CREATE TRIGGER IF NOT EXISTS trg_rollup_doctors_ai AFTER INSERT ON doctors
+BEGIN
+    UPDATE dashboard_rollup SET value = value + 1, updated_at = datetime('now') WHERE metric = 'doctors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_doctors_ad AFTER DELETE ON doctors
+BEGIN
+    UPDATE dashboard_rollup SET value = value - 1, updated_at = datetime('now') WHERE metric = 'doctors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_appointments_ai AFTER INSERT ON appointments
+BEGIN
+    UPDATE dashboard_rollup SET value = value + 1, updated_at = datetime('now') WHERE metric = 'appointments';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_appointments_ad AFTER DELETE ON appointments
+BEGIN
+    UPDATE dashboard_rollup SET value = value - 1, updated_at = datetime('now') WHERE metric = 'appointments';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_bills_ai AFTER INSERT ON bills
+BEGIN
+    UPDATE dashboard_rollup SET value = value + 1, updated_at = datetime('now') WHERE metric = 'bills';
+    UPDATE dashboard_rollup SET value = value + COALESCE(NEW.total_amount, 0), updated_at = datetime('now') WHERE metric = 'revenue_total';
+    UPDATE dashboard_rollup SET value = value + CASE WHEN NEW.paid = 1 THEN COALESCE(NEW.total_amount, 0) ELSE 0 END, updated_at = datetime('now') WHERE metric = 'revenue_paid';
+    UPDATE dashboard_rollup SET value = value + CASE WHEN NEW.paid = 1 THEN 0 ELSE COALESCE(NEW.total_amount, 0) END, updated_at = datetime('now') WHERE metric = 'revenue_pending';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_bills_ad AFTER DELETE ON bills
+BEGIN
+    UPDATE dashboard_rollup SET value = value - 1, updated_at = datetime('now') WHERE metric = 'bills';
+    UPDATE dashboard_rollup SET value = value - COALESCE(OLD.total_amount, 0), updated_at = datetime('now') WHERE metric = 'revenue_total';
+    UPDATE dashboard_rollup SET value = value - CASE WHEN OLD.paid = 1 THEN COALESCE(OLD.total_amount, 0) ELSE 0 END, updated_at = datetime('now') WHERE metric = 'revenue_paid';
+    UPDATE dashboard_rollup SET value = value - CASE WHEN OLD.paid = 1 THEN 0 ELSE COALESCE(OLD.total_amount, 0) END, updated_at = datetime('now') WHERE metric = 'revenue_pending';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_bills_au AFTER UPDATE ON bills
+BEGIN
+    UPDATE dashboard_rollup SET value = value + COALESCE(NEW.total_amount, 0) - COALESCE(OLD.total_amount, 0), updated_at = datetime('now') WHERE metric = 'revenue_total';
+    UPDATE dashboard_rollup SET value = value
+        + CASE WHEN NEW.paid = 1 THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+        - CASE WHEN OLD.paid = 1 THEN COALESCE(OLD.total_amount, 0) ELSE 0 END,
+        updated_at = datetime('now') WHERE metric = 'revenue_paid';
+    UPDATE dashboard_rollup SET value = value
+        + CASE WHEN NEW.paid = 1 THEN 0 ELSE COALESCE(NEW.total_amount, 0) END
+        - CASE WHEN OLD.paid = 1 THEN 0 ELSE COALESCE(OLD.total_amount, 0) END,
+        updated_at = datetime('now') WHERE metric = 'revenue_pending';
+END;
+"""
+
+# -----------------------
+# hot-path indexes
+# -----------------------
+# The list/dashboard routes JOIN and filter on these columns constantly
+# (bill_items.bill_id, appointments.doctor_id/patient_id/datetime,
+# bills.created_at, patients.doctor). Without them SQLite full-scans or
+# builds throwaway automatic indexes on every query.
+HOT_PATH_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_bi_bill ON bill_items(bill_id, item_type, paid);
+DROP INDEX IF EXISTS idx_appt_doctor;
+CREATE INDEX IF NOT EXISTS idx_appt_doctor_dt ON appointments(doctor_id, appointment_datetime);
+CREATE INDEX IF NOT EXISTS idx_appt_dt ON appointments(appointment_datetime DESC);
+CREATE INDEX IF NOT EXISTS idx_appt_patient ON appointments(patient_id, appointment_datetime DESC);
+CREATE INDEX IF NOT EXISTS idx_appt_doctor_patient ON appointments(doctor_id, patient_id);
+CREATE INDEX IF NOT EXISTS idx_bills_patient ON bills(patient_id);
+CREATE INDEX IF NOT EXISTS idx_bills_created ON bills(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_appt_status_dt ON appointments(status, appointment_datetime DESC);
+CREATE INDEX IF NOT EXISTS idx_bills_paid_amt ON bills(paid, total_amount);
+CREATE INDEX IF NOT EXISTS idx_patients_doctor ON patients(doctor);
+
+-- foreign-key covering indexes: SQLite does not index REFERENCES columns
+-- automatically, so FK enforcement, ON DELETE cascades and the billing
+-- triggers' parent lookups all full-scan the child table without these.
+-- Where the doctor views also sort on a date column, the FK index carries
+-- it as a trailing key (and the superseded single-column index is dropped)
+DROP INDEX IF EXISTS idx_treat_patient;
+CREATE INDEX IF NOT EXISTS idx_treat_patient_start ON treatments(patient_id, start_date DESC);
+DROP INDEX IF EXISTS idx_treat_doctor;
+CREATE INDEX IF NOT EXISTS idx_treat_doctor_start ON treatments(doctor_id, start_date DESC);
+CREATE INDEX IF NOT EXISTS idx_treat_room ON treatments(room_id);
+DROP INDEX IF EXISTS idx_presc_patient;
+CREATE INDEX IF NOT EXISTS idx_presc_patient_created ON prescriptions(patient_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_presc_doctor ON prescriptions(doctor_id);
+CREATE INDEX IF NOT EXISTS idx_presc_treatment ON prescriptions(treatment_id);
+CREATE INDEX IF NOT EXISTS idx_presc_items_presc ON prescription_items(prescription_id);
+CREATE INDEX IF NOT EXISTS idx_dispense_presc_item ON med_dispense(prescription_item_id);
+CREATE INDEX IF NOT EXISTS idx_lab_patient ON lab_tests(patient_id);
+CREATE INDEX IF NOT EXISTS idx_lab_doctor ON lab_tests(doctor_id);
+CREATE INDEX IF NOT EXISTS idx_room_assign_patient ON room_assignments(patient_id);
+CREATE INDEX IF NOT EXISTS idx_room_assign_room ON room_assignments(room_id);
+"""
+
+SCHEMA_SQL = """
     -- -----------------------
     -- doctors table (replaces staff)
     -- -----------------------
@@ -26,7 +155,9 @@ def create_hms_db(db_name="hospital_management.db"):
         department TEXT,
         availability TEXT,
         password TEXT,
-        created_at TEXT DEFAULT (datetime('now'))
+        username TEXT,
+        created_at TEXT DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now'))
     );
 
     -- -----------------------
@@ -36,7 +167,7 @@ def create_hms_db(db_name="hospital_management.db"):
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         first_name TEXT NOT NULL,
         last_name TEXT NOT NULL,
-        dob DATE,
+        dob TEXT,
         phone TEXT,
         address TEXT,
         doctor INTEGER REFERENCES doctors(doctor_id) ON DELETE SET NULL,
@@ -51,7 +182,7 @@ def create_hms_db(db_name="hospital_management.db"):
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         room_number TEXT UNIQUE NOT NULL,
         type TEXT,
-        rate_per_day REAL DEFAULT 0
+        rate_per_day REAL DEFAULT 0.0
     );
 
     CREATE TABLE IF NOT EXISTS room_assignments (
@@ -73,7 +204,7 @@ def create_hms_db(db_name="hospital_management.db"):
         appointment_datetime TEXT NOT NULL,
         status TEXT NOT NULL CHECK(status IN ('booked','confirmed','cancelled','completed')) DEFAULT 'booked',
         notes TEXT,
-        fee REAL DEFAULT 0
+        fee REAL DEFAULT 0.0
     );
 
     -- -----------------------
@@ -87,7 +218,7 @@ def create_hms_db(db_name="hospital_management.db"):
         start_date TEXT DEFAULT (datetime('now')),
         end_date TEXT,
         room_id INTEGER REFERENCES rooms(id) ON DELETE SET NULL,
-        cost REAL DEFAULT 0,
+        cost REAL DEFAULT 0.0,
         notes TEXT
     );
 
@@ -110,7 +241,7 @@ def create_hms_db(db_name="hospital_management.db"):
         medication_id INTEGER,
         dosage TEXT,
         quantity INTEGER DEFAULT 1,
-        unit_price REAL DEFAULT 0,
+        unit_price REAL DEFAULT 0.0,
         fulfilled INTEGER DEFAULT 0,
         fulfilled_at TEXT
     );
@@ -140,7 +271,7 @@ def create_hms_db(db_name="hospital_management.db"):
         performed_at TEXT,
         result TEXT,
         status TEXT NOT NULL CHECK(status IN ('ordered','in_progress','completed','cancelled')) DEFAULT 'ordered',
-        cost REAL DEFAULT 0,
+        cost REAL DEFAULT 0.0,
         notes TEXT
     );
 
@@ -150,7 +281,7 @@ def create_hms_db(db_name="hospital_management.db"):
     CREATE TABLE IF NOT EXISTS bills (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
-        total_amount REAL DEFAULT 0,
+        total_amount REAL DEFAULT 0.0,
         paid INTEGER DEFAULT 0,
         created_at TEXT DEFAULT (datetime('now')),
         paid_at TEXT
@@ -162,134 +293,326 @@ def create_hms_db(db_name="hospital_management.db"):
         item_type TEXT NOT NULL,
         item_ref INTEGER,
         description TEXT,
-        amount REAL NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0.0,
         created_at TEXT DEFAULT (datetime('now'))
     );
 
     -- add paid flag and paid_at for item-level payments (migration-friendly)
     -- Note: If the columns already exist, migration below will skip adding them.
+    """
 
-    -- -----------------------
-    -- Triggers
-    -- -----------------------
-    CREATE TRIGGER IF NOT EXISTS trg_ensure_open_bill_after_insert_treatment
-    AFTER INSERT ON treatments
-    BEGIN
-        INSERT INTO bills(patient_id, total_amount, paid, created_at)
-        SELECT NEW.patient_id, 0, 0, datetime('now')
-        WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
-
-        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
-        VALUES (
-            (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1),
-            'treatment',
-            NEW.id,
-            COALESCE(NEW.description,'Treatment'),
-            COALESCE(NEW.cost,0),
-            datetime('now')
-        );
-
-        UPDATE bills
-        SET total_amount = total_amount + COALESCE(NEW.cost,0)
-        WHERE id = (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1);
-    END;
-
-    CREATE TRIGGER IF NOT EXISTS trg_prescription_item_after_insert
-    AFTER INSERT ON prescription_items
-    BEGIN
-        INSERT INTO bills(patient_id, total_amount, paid, created_at)
-        SELECT p.patient_id, 0, 0, datetime('now')
-        FROM prescriptions p
-        WHERE p.id = NEW.prescription_id
-          AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = p.patient_id AND b.paid = 0);
-
-        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
-        VALUES (
-            (SELECT id FROM bills WHERE patient_id = (SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id) AND paid = 0 ORDER BY created_at DESC LIMIT 1),
-            'medication',
-            NEW.id,
-            COALESCE(NEW.medication_name, 'Medication'),
-            COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1),
-            datetime('now')
-        );
-
-        UPDATE bills
-        SET total_amount = total_amount + (COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1))
-        WHERE id = (SELECT id FROM bills WHERE patient_id = (SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id) AND paid = 0 ORDER BY created_at DESC LIMIT 1);
-    END;
-
-    CREATE TRIGGER IF NOT EXISTS trg_lab_test_after_update_completed
-    AFTER UPDATE OF status ON lab_tests
-    WHEN NEW.status = 'completed' AND (OLD.status IS NULL OR OLD.status != 'completed')
-    BEGIN
-        INSERT INTO bills(patient_id, total_amount, paid, created_at)
-        SELECT NEW.patient_id, 0, 0, datetime('now')
-        WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
-
-        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
-        VALUES (
-            (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1),
-            'lab_test',
-            NEW.id,
-            NEW.test_name,
-            COALESCE(NEW.cost,0),
-            datetime('now')
-        );
-
-        UPDATE bills
-        SET total_amount = total_amount + COALESCE(NEW.cost,0)
-        WHERE id = (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1);
-    END;
+# replacement appointments table used by the legacy NOT NULL rebuild below
+APPOINTMENTS_REBUILD_SQL = """
+CREATE TABLE IF NOT EXISTS appointments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    doctor_id INTEGER REFERENCES doctors(doctor_id) ON DELETE SET NULL,
+    appointment_datetime TEXT NOT NULL,
+    status TEXT NOT NULL CHECK(status IN ('booked','confirmed','cancelled','completed')) DEFAULT 'booked',
+    notes TEXT,
+    fee REAL DEFAULT 0.0
+);
+"""
+
+# STRICT tables (SQLite 3.37+) enforce declared column types and let the
+# engine pack rows tighter. Every CREATE TABLE above is IF NOT EXISTS, so
+# only freshly created databases pick this up; existing tables keep their
+# legacy layout and nothing is rebuilt for them.
+if HAS_STRICT:
+    SCHEMA_SQL = SCHEMA_SQL.replace(");", ") STRICT;")
+    APPOINTMENTS_REBUILD_SQL = APPOINTMENTS_REBUILD_SQL.replace(");", ") STRICT;")
+
+
+# every table the schema script creates; used to skip re-parsing the whole
+# script when a migrating DB already has them all
+EXPECTED_TABLES = frozenset({
+    'doctors', 'patients', 'rooms', 'room_assignments', 'appointments',
+    'treatments', 'prescriptions', 'prescription_items', 'med_dispense',
+    'lab_tests', 'bills', 'bill_items',
+})
+
+# Enforces the one-open-bill-per-patient invariant the billing triggers
+# assume, and turns every open-bill lookup into a single index probe.
+# Kept separate from HOT_PATH_INDEXES because creation legitimately fails
+# on a legacy DB that already violates the invariant; the triggers stay
+# correct either way.
+if HAS_PARTIAL_IDX:
+    OPEN_BILL_UNIQUE_INDEX = (
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_bills_open_per_patient "
+        "ON bills(patient_id) WHERE paid = 0;"
+    )
+else:
+    # no partial indexes on this engine: settle for a plain lookup index and
+    # leave the invariant to the triggers' OR IGNORE ensure-bill insert
+    OPEN_BILL_UNIQUE_INDEX = (
+        "CREATE INDEX IF NOT EXISTS idx_bills_patient_paid "
+        "ON bills(patient_id, paid);"
+    )
+
+# Login lookups go through this instead of scanning on the computed
+# f_name || l_name expression. Unique, so creation can fail on a legacy DB
+# with duplicate doctor names; login then falls back to the name scan.
+DOCTOR_USERNAME_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_doctors_username "
+    "ON doctors(username);"
+)
+
+# Canonical join shapes shared by several doctor views. Naming them keeps
+# the route SQL short and byte-identical across handlers (better prepared-
+# statement cache hits) and gives one place to change if the join ever
+# does. Dropped and recreated like the triggers so definition updates reach
+# older databases; columns are listed explicitly because SQLite freezes a
+# view's SELECT when it is created.
+DOCTOR_VIEWS = """
+DROP VIEW IF EXISTS v_treatments_with_patient;
+CREATE VIEW v_treatments_with_patient AS
+    SELECT t.id, t.patient_id, t.doctor_id, t.description, t.start_date,
+           t.end_date, p.first_name, p.last_name
+    FROM treatments t
+    LEFT JOIN patients p ON p.id = t.patient_id;
+
+DROP VIEW IF EXISTS v_appointments_with_patient;
+CREATE VIEW v_appointments_with_patient AS
+    SELECT a.id, a.patient_id, a.doctor_id, a.appointment_datetime, a.status,
+           a.notes, p.first_name, p.last_name
+    FROM appointments a
+    LEFT JOIN patients p ON p.id = a.patient_id;
+"""
+
+# Keeps doctors.updated_at honest on every row edit so the roster/profile
+# ETag stamps move exactly when a doctor row does. SQLite triggers are
+# non-recursive by default, so the touch UPDATE doesn't re-fire it.
+DOCTOR_TOUCH_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS trg_doctors_touch AFTER UPDATE ON doctors
+BEGIN
+    UPDATE doctors SET updated_at = datetime('now') WHERE doctor_id = NEW.doctor_id;
+END;
+"""
+
+# -----------------------
+# billing triggers
+# -----------------------
+# The three billing triggers are the same program over different source
+# events, so they are generated from one template: ensure the patient's open
+# bill exists (OR IGNORE + NOT EXISTS, backed by ux_bills_open_per_patient),
+# add the bill item, then bump the open bill's total by addressing it
+# directly via (patient_id, paid = 0). DROP + CREATE (rather than IF NOT
+# EXISTS) so existing DBs always carry the current bodies. SQLite trigger
+# programs cannot bind an intermediate value across statements, which is why
+# the patient expression is inlined wherever it is needed.
+_BILLING_TRIGGER_TEMPLATE = """
+DROP TRIGGER IF EXISTS {name};
+CREATE TRIGGER {name}
+{event}
+{when}BEGIN
+    INSERT OR IGNORE INTO bills(patient_id, total_amount, paid)
+    SELECT {patient}, 0, 0
+    WHERE {patient} IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = {patient} AND b.paid = 0);
+
+    INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount)
+    VALUES (
+        (SELECT id FROM bills WHERE patient_id = {patient} AND paid = 0 ORDER BY id DESC LIMIT 1),
+        '{item_type}',
+        NEW.id,
+        {description},
+        {amount}
+    );
+
+    UPDATE bills
+    SET total_amount = total_amount + ({amount})
+    WHERE patient_id = {patient} AND paid = 0;
+END;
+"""
+
+# (name, firing event, extra WHEN clause, item_type, patient expr,
+#  description expr, amount expr)
+_BILLING_EVENTS = (
+    ('trg_ensure_open_bill_after_insert_treatment',
+     'AFTER INSERT ON treatments', '',
+     'treatment',
+     'NEW.patient_id',
+     "COALESCE(NEW.description,'Treatment')",
+     'COALESCE(NEW.cost,0)'),
+    ('trg_prescription_item_after_insert',
+     'AFTER INSERT ON prescription_items', '',
+     'medication',
+     '(SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id)',
+     "COALESCE(NEW.medication_name, 'Medication')",
+     'COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1)'),
+    ('trg_lab_test_after_update_completed',
+     'AFTER UPDATE OF status ON lab_tests',
+     "WHEN NEW.status = 'completed' AND (OLD.status IS NULL OR OLD.status != 'completed')\n",
+     'lab_test',
+     'NEW.patient_id',
+     'NEW.test_name',
+     'COALESCE(NEW.cost,0)'),
+)
+
+BILLING_TRIGGERS = ''.join(
+    _BILLING_TRIGGER_TEMPLATE.format(
+        name=name, event=event, when=when, item_type=item_type,
+        patient=patient, description=description, amount=amount)
+    for name, event, when, item_type, patient, description, amount in _BILLING_EVENTS
+)
+
+# authoritative queries used to (re)seed the rollup from the base tables
+DASHBOARD_ROLLUP_METRICS = {
+    'patients': "SELECT COUNT(*) FROM patients",
+    'doctors': "SELECT COUNT(*) FROM doctors",
+    'bills': "SELECT COUNT(*) FROM bills",
+    'appointments': "SELECT COUNT(*) FROM appointments",
+    'revenue_paid': "SELECT COALESCE(SUM(CASE WHEN paid = 1 THEN total_amount ELSE 0 END), 0) FROM bills",
+    'revenue_pending': "SELECT COALESCE(SUM(CASE WHEN paid = 0 THEN total_amount ELSE 0 END), 0) FROM bills",
+    'revenue_total': "SELECT COALESCE(SUM(total_amount), 0) FROM bills",
+}
+
+
+def seed_dashboard_rollup(conn):
+    """Recompute every rollup metric from the base tables (caller commits)."""
+    values = {}
+    for metric in ('patients', 'doctors', 'bills', 'appointments'):
+        values[metric] = conn.execute(DASHBOARD_ROLLUP_METRICS[metric]).fetchone()[0] or 0
+    # one GROUP BY pass over idx_bills_paid_amt covers all three revenue
+    # metrics instead of three SUM(CASE ...) scans of bills
+    paid_amount = pending_amount = 0
+    for row in conn.execute("SELECT paid, COALESCE(SUM(total_amount), 0) FROM bills GROUP BY paid"):
+        if row[0] == 1:
+            paid_amount += row[1]
+        else:
+            pending_amount += row[1]
+    values['revenue_paid'] = paid_amount
+    values['revenue_pending'] = pending_amount
+    values['revenue_total'] = paid_amount + pending_amount
+    for metric, value in values.items():
+        conn.execute(
+            "INSERT OR REPLACE INTO dashboard_rollup (metric, value, updated_at) VALUES (?, ?, datetime('now'))",
+            (metric, value)
+        )
+
+
+def create_hms_db(db_name="hospital_management.db", conn=None):
+    """Create/upgrade the HMS schema.
+
+    Pass an existing connection to reuse its page cache and prepared
+    statements (it is left open and returned); otherwise a connection is
+    opened for the call and closed before returning.
     """
+    owns_conn = conn is None
+    if owns_conn:
+        conn = sqlite3.connect(db_name, check_same_thread=False)
+    c = conn.cursor()
+
+    # Enable foreign keys
+    c.execute("PRAGMA foreign_keys = ON;")
+    # Use WAL journal mode to reduce locking contention (allows concurrent reads/writes)
+    try:
+        c.execute("PRAGMA journal_mode = WAL;")
+        c.execute("PRAGMA synchronous = NORMAL;")
+        # standard performance set: 32MB page cache, in-memory temp b-trees,
+        # 256MB mmap window, 5s busy wait, bounded WAL size
+        c.execute("PRAGMA cache_size = -32000;")
+        c.execute("PRAGMA temp_store = MEMORY;")
+        c.execute("PRAGMA mmap_size = 268435456;")
+        c.execute("PRAGMA busy_timeout = 5000;")
+        c.execute("PRAGMA journal_size_limit = 6144000;")
+    except Exception:
+        pass
+
+    # fast path: a DB stamped with the current schema version needs no DDL,
+    # no migration probes and no reseed (the triggers keep the rollup fresh)
+    if c.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        # cheap incremental ANALYZE: only re-gathers stats for tables whose
+        # content changed materially since the last run
+        try:
+            c.execute("PRAGMA optimize;")
+        except Exception:
+            pass
+        if owns_conn:
+            conn.close()
+        print(f"Database '{db_name}' already at schema version {SCHEMA_VERSION}.")
+        return conn
+
+
+    # migration chatter is collected here and written to stdout in a single
+    # syscall after commit, instead of one flushed print per step
+    msgs = []
+
+    # only parse the ~30-statement schema script when something is actually
+    # missing; a DB that merely needs migrations skips it on one catalog read
+    existing = {r[0] for r in c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not EXPECTED_TABLES <= existing:
+        c.executescript(SCHEMA_SQL)
+    # Run every migration ALTER below inside one explicit write transaction so
+    # the whole batch flushes with a single fsync instead of committing
+    # per-statement. The executescript() calls further down manage their own
+    # transactions, so the batch is committed before they run.
+    c.execute("BEGIN IMMEDIATE;")
+
+    # one PRAGMA table_info per table, cached for every membership check below
+    cols_cache = {}
+
+    def table_cols(tbl, refresh=False):
+        if refresh or tbl not in cols_cache:
+            cols_cache[tbl] = {r[1]: r for r in c.execute(f"PRAGMA table_info({tbl});").fetchall()}
+        return cols_cache[tbl]
 
-    c.executescript(schema)
     # --- Migration: ensure 'password' column exists on doctors for older DBs ---
     try:
-        cols = [r[1] for r in c.execute("PRAGMA table_info(doctors);").fetchall()]
-        if 'password' not in cols:
+        if 'password' not in table_cols('doctors'):
             c.execute("ALTER TABLE doctors ADD COLUMN password TEXT;")
-            print("Added 'password' column to doctors table (migration).")
+            msgs.append("Added 'password' column to doctors table (migration).")
     except Exception:
         # If doctors table doesn't exist yet or other issue, ignore here — schema creation above will handle it
         pass
+    # --- Migration: stored username for indexed doctor login lookups ---
+    try:
+        if 'username' not in table_cols('doctors'):
+            c.execute("ALTER TABLE doctors ADD COLUMN username TEXT;")
+            msgs.append("Added 'username' column to doctors table (migration).")
+        c.execute("UPDATE doctors SET username = f_name || l_name WHERE username IS NULL OR username = '';")
+    except Exception:
+        pass
+    # --- Migration: updated_at stamp for the roster/profile ETags ---
+    try:
+        if 'updated_at' not in table_cols('doctors'):
+            # ALTER can't add a column with a non-constant default; add it
+            # bare and backfill (the table default covers fresh databases)
+            c.execute("ALTER TABLE doctors ADD COLUMN updated_at TEXT;")
+            c.execute("UPDATE doctors SET updated_at = COALESCE(created_at, datetime('now')) WHERE updated_at IS NULL;")
+            msgs.append("Added 'updated_at' column to doctors table (migration).")
+    except Exception:
+        pass
     # --- Migration: ensure 'doctor' and 'department' columns exist on patients for older DBs ---
     try:
-        pcols = [r[1] for r in c.execute("PRAGMA table_info(patients);").fetchall()]
-        if 'doctor' not in pcols:
+        if 'doctor' not in table_cols('patients'):
             c.execute("ALTER TABLE patients ADD COLUMN doctor INTEGER;")
-            print("Added 'doctor' column to patients table (migration).")
-        if 'department' not in pcols:
+            msgs.append("Added 'doctor' column to patients table (migration).")
+        if 'department' not in table_cols('patients'):
             c.execute("ALTER TABLE patients ADD COLUMN department TEXT;")
-            print("Added 'department' column to patients table (migration).")
+            msgs.append("Added 'department' column to patients table (migration).")
     except Exception:
         pass
     # --- Migration: make appointments.doctor_id nullable if older DB has NOT NULL constraint ---
     try:
-        ap_cols = c.execute("PRAGMA table_info(appointments);").fetchall()
-        # PRAGMA table_info returns rows: (cid, name, type, notnull, dflt_value, pk)
-        doctor_col = None
-        for col in ap_cols:
-            if col[1] == 'doctor_id':
-                doctor_col = col
-                break
+        # table_info rows: (cid, name, type, notnull, dflt_value, pk)
+        doctor_col = table_cols('appointments').get('doctor_id')
         if doctor_col is not None and doctor_col[3] == 1:
-            print("Found NOT NULL constraint on appointments.doctor_id — migrating to allow NULLs...")
+            msgs.append("Found NOT NULL constraint on appointments.doctor_id — migrating to allow NULLs...")
+            # the FK pragma is a no-op inside a transaction: flush the batched
+            # ALTERs first, rebuild in autocommit, then reopen the batch below
+            c.execute("COMMIT;")
             # Disable foreign keys temporarily for table rebuild
             c.execute('PRAGMA foreign_keys = OFF;')
+            # One transaction for the whole rebuild: rename/create/copy/drop
+            # commit together (and fsync once) instead of per statement, and
+            # deferred FK checks skip the per-row probe during the bulk copy
+            c.execute('BEGIN IMMEDIATE;')
+            c.execute('PRAGMA defer_foreign_keys = ON;')
             # Rename old table
             c.execute('ALTER TABLE appointments RENAME TO appointments_old;')
             # Create new appointments table with doctor_id nullable
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS appointments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
-                    doctor_id INTEGER REFERENCES doctors(doctor_id) ON DELETE SET NULL,
-                    appointment_datetime TEXT NOT NULL,
-                    status TEXT NOT NULL CHECK(status IN ('booked','confirmed','cancelled','completed')) DEFAULT 'booked',
-                    notes TEXT,
-                    fee REAL DEFAULT 0
-                );
-            ''')
+            c.execute(APPOINTMENTS_REBUILD_SQL)
             # Copy data across (keep existing doctor_id values)
             c.execute('''
                 INSERT INTO appointments (id, patient_id, doctor_id, appointment_datetime, status, notes, fee)
@@ -297,62 +620,112 @@ def create_hms_db(db_name="hospital_management.db"):
             ''')
             # Drop old table
             c.execute('DROP TABLE appointments_old;')
+            c.execute('COMMIT;')
             # Re-enable foreign keys
             c.execute('PRAGMA foreign_keys = ON;')
-            print('Migrated appointments table to allow NULL doctor_id.')
+            table_cols('appointments', refresh=True)
+            msgs.append('Migrated appointments table to allow NULL doctor_id.')
     except Exception as ex:
         # If appointments table doesn't exist yet or migration fails, print and continue
-        print('appointments migration skipped or failed:', ex)
+        msgs.append(f'appointments migration skipped or failed: {ex}')
+    # reopen the migration batch if the rebuild path committed it
+    if not conn.in_transaction:
+        c.execute("BEGIN IMMEDIATE;")
     # --- Migration: ensure 'actions' column exists on appointments for older DBs ---
     try:
-        acols = [r[1] for r in c.execute("PRAGMA table_info(appointments);").fetchall()]
-        if 'actions' not in acols:
+        if 'actions' not in table_cols('appointments'):
             c.execute("ALTER TABLE appointments ADD COLUMN actions TEXT;")
-            print("Added 'actions' column to appointments table (migration).")
+            msgs.append("Added 'actions' column to appointments table (migration).")
     except Exception:
         # ignore if appointments table doesn't exist yet
         pass
     # --- Migration: ensure 'paid' and 'paid_at' exist on bill_items for item-level payments ---
     try:
-        bi_cols = [r[1] for r in c.execute("PRAGMA table_info(bill_items);").fetchall()]
-        if 'paid' not in bi_cols:
+        if 'paid' not in table_cols('bill_items'):
             c.execute("ALTER TABLE bill_items ADD COLUMN paid INTEGER DEFAULT 0;")
-            print("Added 'paid' column to bill_items table (migration).")
-        if 'paid_at' not in bi_cols:
+            msgs.append("Added 'paid' column to bill_items table (migration).")
+        if 'paid_at' not in table_cols('bill_items'):
             c.execute("ALTER TABLE bill_items ADD COLUMN paid_at TEXT;")
-            print("Added 'paid_at' column to bill_items table (migration).")
+            msgs.append("Added 'paid_at' column to bill_items table (migration).")
     except Exception:
         pass
     # --- Migration: ensure 'treatment_id' exists on prescriptions to link to treatments ---
     try:
-        presc_cols = [r[1] for r in c.execute("PRAGMA table_info(prescriptions);").fetchall()]
-        if 'treatment_id' not in presc_cols:
+        if 'treatment_id' not in table_cols('prescriptions'):
             c.execute("ALTER TABLE prescriptions ADD COLUMN treatment_id INTEGER REFERENCES treatments(id) ON DELETE SET NULL;")
-            print("Added 'treatment_id' column to prescriptions table (migration).")
+            msgs.append("Added 'treatment_id' column to prescriptions table (migration).")
     except Exception:
         pass
     # --- Migration: ensure 'prescription_id' exists on treatments to link to prescriptions (bidirectional) ---
     try:
-        treat_cols = [r[1] for r in c.execute("PRAGMA table_info(treatments);").fetchall()]
-        if 'prescription_id' not in treat_cols:
+        if 'prescription_id' not in table_cols('treatments'):
             c.execute("ALTER TABLE treatments ADD COLUMN prescription_id INTEGER REFERENCES prescriptions(id) ON DELETE SET NULL;")
-            print("Added 'prescription_id' column to treatments table (migration).")
+            msgs.append("Added 'prescription_id' column to treatments table (migration).")
     except Exception:
         pass
     # --- Migration: add medication_name and description to prescription_items (eliminate medications table dependency) ---
     try:
-        pi_cols = [r[1] for r in c.execute("PRAGMA table_info(prescription_items);").fetchall()]
-        if 'medication_name' not in pi_cols:
+        if 'medication_name' not in table_cols('prescription_items'):
             c.execute("ALTER TABLE prescription_items ADD COLUMN medication_name TEXT;")
-            print("Added 'medication_name' column to prescription_items table (migration).")
-        if 'medication_description' not in pi_cols:
+            msgs.append("Added 'medication_name' column to prescription_items table (migration).")
+        if 'medication_description' not in table_cols('prescription_items'):
             c.execute("ALTER TABLE prescription_items ADD COLUMN medication_description TEXT;")
-            print("Added 'medication_description' column to prescription_items table (migration).")
+            msgs.append("Added 'medication_description' column to prescription_items table (migration).")
     except Exception:
         pass
+    # single commit for all batched migration ALTERs
+    if conn.in_transaction:
+        c.execute("COMMIT;")
+    # --- One-open-bill-per-patient invariant (also powers trigger lookups) ---
+    try:
+        c.execute(OPEN_BILL_UNIQUE_INDEX)
+    except Exception as ex:
+        msgs.append(f'open-bill unique index skipped (existing data violates it?): {ex}')
+    # --- Unique username index for the doctor login path ---
+    try:
+        c.execute(DOCTOR_USERNAME_INDEX)
+    except Exception as ex:
+        msgs.append(f'doctor username index skipped (duplicate names?): {ex}')
+    # --- updated_at touch trigger backing the doctor ETag stamps ---
+    try:
+        c.execute(DOCTOR_TOUCH_TRIGGER)
+    except Exception as ex:
+        msgs.append(f'doctors touch trigger skipped or failed: {ex}')
+    # --- named views for the doctor list queries ---
+    try:
+        c.executescript(DOCTOR_VIEWS)
+    except Exception as ex:
+        msgs.append(f'doctor view creation skipped or failed: {ex}')
+    # --- Billing triggers (always recreated so bodies stay current) ---
+    try:
+        c.executescript(BILLING_TRIGGERS)
+    except Exception as ex:
+        msgs.append(f'billing trigger creation skipped or failed: {ex}')
+    # --- Indexes for the hot JOIN/GROUP BY/ORDER BY columns ---
+    try:
+        c.executescript(HOT_PATH_INDEXES)
+    except Exception as ex:
+        msgs.append(f'index creation skipped or failed: {ex}')
+    # --- Dashboard rollup table + maintenance triggers, seeded from current data ---
+    try:
+        c.executescript(DASHBOARD_ROLLUP_SCHEMA)
+        seed_dashboard_rollup(c)
+    except Exception as ex:
+        msgs.append(f'dashboard_rollup setup skipped or failed: {ex}')
+    # stamp so the next run takes the fast path above
+    c.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
     conn.commit()
-    conn.close()
-    print(f"✅ Database '{db_name}' created successfully with all tables and triggers.")
+    # full ANALYZE after a migration pass so the planner has sqlite_stat1
+    # rows for the freshly created indexes instead of guessing
+    try:
+        c.execute("ANALYZE;")
+    except Exception:
+        pass
+    if owns_conn:
+        conn.close()
+    msgs.append(f"✅ Database '{db_name}' created successfully with all tables and triggers.")
+    sys.stdout.write("\n".join(msgs) + "\n")
+    return conn
 
 
 if __name__ == "__main__":
@@ -1,101 +1,290 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, make_response
+from werkzeug.security import check_password_hash, generate_password_hash
+import collections
+import hmac
 import sqlite3
+import threading
+import time
 import os
 
+import db
+
 doctor_bp = Blueprint('doctor', __name__)
 
 # DB path relative to this module
 DATABASE = os.path.join(os.path.dirname(__file__), 'hospital_management.db')
 
 _migration_done = False
+_migration_lock = threading.Lock()
+
+# Hot SQL hoisted to module constants: the per-connection prepared-statement
+# cache (cached_statements=256 in db.connect) keys on the exact SQL text, so
+# issuing the identical string every time turns repeat queries into cache
+# hits instead of re-parse + re-plan.
+SQL_TREATMENTS_BY_PATIENT = 'SELECT id, description, start_date, end_date FROM treatments WHERE patient_id = ? ORDER BY start_date DESC'
+
+# the three view_patient page sections in one round-trip: each arm is tagged
+# with a kind column and padded to a common shape, partitioned back into
+# section lists in Python. Binds (pid, pid, pid, did).
+SQL_PATIENT_SECTIONS = '''
+    SELECT 't' AS kind, id AS c1, description AS c2, start_date AS c3,
+           end_date AS c4, start_date AS sort_key
+    FROM treatments WHERE patient_id = ?
+    UNION ALL
+    SELECT 'p', p.treatment_id, p.notes,
+           GROUP_CONCAT(pi.medication_name, ', '),
+           GROUP_CONCAT(pi.dosage, ', '), p.created_at
+    FROM prescriptions p
+    LEFT JOIN prescription_items pi ON pi.prescription_id = p.id
+    WHERE p.patient_id = ?
+    GROUP BY p.id
+    UNION ALL
+    SELECT 'a', NULL, notes, appointment_datetime, NULL, appointment_datetime
+    FROM appointments WHERE patient_id = ? AND doctor_id = ?
+    ORDER BY kind, sort_key DESC
+'''
+
+# view_logs payload cache: the logs page is read-mostly, so the built
+# structure is kept per doctor and reused while a cheap stamp query (max id +
+# row count over the doctor's treatments, an index-only scan) is unchanged.
+# Inserts bump MAX(id); deletes change COUNT(*); description edits invalidate
+# explicitly from edit_treatment. Only the cursor-less first page is cached
+# (one entry per doctor): keying on the client-supplied cursor would let a
+# single doctor grow the cache without bound by fabricating `after` values.
+_logs_cache = {}
+
+# lightweight tuple rows for bulk read paths: namedtuple construction is a
+# plain tuple fill, skipping sqlite3.Row's per-row column-name mapping, and
+# Jinja's attribute fallback renders them the same way. One type per distinct
+# column tuple, built lazily.
+_nt_types = {}
+
+def _nt_factory(cursor, row):
+    cols = tuple(d[0] for d in cursor.description)
+    nt = _nt_types.get(cols)
+    if nt is None:
+        nt = collections.namedtuple('RowNT', cols, rename=True)
+        _nt_types[cols] = nt
+    return nt._make(row)
+
+# public roster cache for /doctors: hit by every visitor. Validated against
+# the roster stamp below when the DB has one, with a 60-second TTL as the
+# fallback on a pre-v10 database.
+_roster_cache = {'rows': None, 'at': 0.0, 'etag': None}
+_ROSTER_TTL = 60.0
+
+# strong roster validator: the doctors touch trigger moves MAX(updated_at)
+# on any row edit and COUNT(*) moves on delete. MAX(doctor_id) covers
+# inserts even on a migrated DB where updated_at was ALTERed in without a
+# default and a row slipped through with it NULL — without it a
+# delete-one/add-one between visits could leave the stamp unchanged and
+# serve a false 304.
+SQL_ROSTER_STAMP = (
+    "SELECT COALESCE(MAX(updated_at), '0') || '/' || COUNT(*) || '/' || "
+    "COALESCE(MAX(doctor_id), 0) FROM doctors"
+)
+
+# per-doctor profile cache: the page is read-mostly, so entries live for a
+# short TTL and a doctor's own writes (new treatment notes) drop their entry
+# so the profile reflects them immediately
+_profile_cache = {}
+_PROFILE_TTL = 30.0
+
+# list pages are capped at PAGE_SIZE rows per response so a multi-year
+# dataset can't balloon a single render; one extra row is fetched past the
+# cap purely to signal that a next page exists
+PAGE_SIZE = 50
+
+
+def _page_arg():
+    try:
+        return max(1, int(request.args.get('page', 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _drop_cached(cache, did):
+    # cache keys are tuples led by the doctor id; drop every page for them
+    for key in [k for k in cache if k[0] == did]:
+        cache.pop(key, None)
+
+SQL_LOGS_STAMP = 'SELECT MAX(id), COUNT(*) FROM treatments WHERE doctor_id = ?'
+
+# logs pages use a keyset cursor — the link to the next page carries the last
+# rendered (start_date, id) — so page N is the same single index seek as
+# page 1, where OFFSET would walk and discard N*PAGE_SIZE rows first
+SQL_LOGS_PAGE = '''
+    SELECT id, patient_id, start_date, description, first_name, last_name
+    FROM v_treatments_with_patient
+    WHERE doctor_id = ?
+    ORDER BY start_date DESC, id DESC
+    LIMIT ?
+'''
+
+SQL_LOGS_PAGE_AFTER = '''
+    SELECT id, patient_id, start_date, description, first_name, last_name
+    FROM v_treatments_with_patient
+    WHERE doctor_id = ? AND (start_date, id) < (?, ?)
+    ORDER BY start_date DESC, id DESC
+    LIMIT ?
+'''
+
+# patient roster for a doctor: two index-sargable arms deduplicated by UNION
+# instead of the old OR across a patients x appointments LEFT JOIN + DISTINCT
+SQL_DOCTOR_PATIENTS_BRIEF = '''
+    SELECT id, first_name, last_name FROM patients WHERE doctor = ?
+    UNION
+    SELECT id, first_name, last_name FROM patients
+    WHERE id IN (SELECT patient_id FROM appointments WHERE doctor_id = ?)
+    ORDER BY first_name, last_name
+'''
+
+SQL_DOCTOR_PATIENTS_FULL = '''
+    SELECT id, first_name, last_name, dob, phone FROM patients WHERE doctor = ?
+    UNION
+    SELECT id, first_name, last_name, dob, phone FROM patients
+    WHERE id IN (SELECT patient_id FROM appointments WHERE doctor_id = ?)
+    ORDER BY first_name, last_name
+'''
+
+SQL_DOCTOR_PATIENTS_FULL_PAGE = SQL_DOCTOR_PATIENTS_FULL + ' LIMIT ? OFFSET ?'
+
+# patient row and the authorization test in one statement: the EXISTS arm is
+# a single probe of idx_appt_doctor_patient, so an access denial costs the
+# same one round-trip as a grant. Binds (did, did, pid).
+SQL_PATIENT_WITH_ACCESS = '''
+    SELECT id, first_name, last_name,
+           (doctor = ? OR EXISTS (SELECT 1 FROM appointments
+                                  WHERE patient_id = patients.id AND doctor_id = ?)) AS accessible
+    FROM patients WHERE id = ?
+'''
+
+SQL_PRESCRIPTIONS_FOR_DOCTOR_PATIENTS = '''
+    SELECT p.patient_id, p.id, p.created_at, p.notes, p.treatment_id,
+           GROUP_CONCAT(pi.medication_name, ', ') AS medications,
+           GROUP_CONCAT(pi.dosage, ', ') AS dosages
+    FROM prescriptions p
+    LEFT JOIN prescription_items pi ON pi.prescription_id = p.id
+    WHERE p.patient_id IN (SELECT DISTINCT patient_id FROM treatments WHERE doctor_id = ?)
+    GROUP BY p.id
+    ORDER BY p.created_at DESC
+'''
 
 def ensure_bidirectional_links():
     """Ensure prescription_id column exists on treatments table and medication fields in prescription_items."""
     global _migration_done
     if _migration_done:
         return
+    # double-checked lock: runs once at blueprint registration, and two
+    # threaded first requests can't both open a migration connection
+    with _migration_lock:
+        if _migration_done:
+            return
+        _run_bidirectional_migration()
+
+
+def _run_bidirectional_migration():
+    global _migration_done
     try:
         conn = sqlite3.connect(DATABASE, timeout=30)
-        cols = [r[1] for r in conn.execute("PRAGMA table_info(treatments);").fetchall()]
-        if 'prescription_id' not in cols:
-            conn.execute("ALTER TABLE treatments ADD COLUMN prescription_id INTEGER REFERENCES prescriptions(id) ON DELETE SET NULL;")
-            conn.commit()
-            print("Runtime migration: Added prescription_id to treatments table.")
-        
-        pi_cols = [r[1] for r in conn.execute("PRAGMA table_info(prescription_items);").fetchall()]
-        if 'medication_name' not in pi_cols:
-            conn.execute("ALTER TABLE prescription_items ADD COLUMN medication_name TEXT;")
-            conn.commit()
-            print("Runtime migration: Added medication_name to prescription_items table.")
-        if 'medication_description' not in pi_cols:
-            conn.execute("ALTER TABLE prescription_items ADD COLUMN medication_description TEXT;")
+        # all ALTERs commit together: one fsync, and a failure rolls the
+        # whole batch back instead of persisting a partial migration
+        try:
+            cols = [r[1] for r in conn.execute("PRAGMA table_info(treatments);").fetchall()]
+            if 'prescription_id' not in cols:
+                conn.execute("ALTER TABLE treatments ADD COLUMN prescription_id INTEGER REFERENCES prescriptions(id) ON DELETE SET NULL;")
+                print("Runtime migration: Added prescription_id to treatments table.")
+
+            pi_cols = [r[1] for r in conn.execute("PRAGMA table_info(prescription_items);").fetchall()]
+            if 'medication_name' not in pi_cols:
+                conn.execute("ALTER TABLE prescription_items ADD COLUMN medication_name TEXT;")
+                print("Runtime migration: Added medication_name to prescription_items table.")
+            if 'medication_description' not in pi_cols:
+                conn.execute("ALTER TABLE prescription_items ADD COLUMN medication_description TEXT;")
+                print("Runtime migration: Added medication_description to prescription_items table.")
+
             conn.commit()
-            print("Runtime migration: Added medication_description to prescription_items table.")
-        
-        conn.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         _migration_done = True
     except Exception as e:
         print(f"Migration check failed: {e}")
 
+@doctor_bp.record_once
+def _migrate_on_register(state):
+    # one-shot at app startup so view_patient doesn't re-check per request
+    ensure_bidirectional_links()
+
+
 def get_conn():
-    # increase timeout and allow connections from different threads (dev server may use threads)
-    conn = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        conn.execute('PRAGMA foreign_keys = ON;')
-    except Exception:
-        pass
-    return conn
+    # request-scoped connection shared with the other blueprints; its page
+    # cache and prepared statements survive across queries within a request
+    # and it is closed by db.close_db() at app-context teardown
+    return db.get_db()
 
 
 @doctor_bp.route('/logs')
 def view_logs():
-    from flask import session, redirect, flash
     # require doctor login
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
+    after = request.args.get('after')
+    after_id = request.args.get('after_id', type=int)
     conn = get_conn()
-    # include patient name and limit logs to this doctor
-    logs = conn.execute('''
-        SELECT t.*, p.first_name || ' ' || p.last_name AS patient_name
-        FROM treatments t
-        LEFT JOIN patients p ON p.id = t.patient_id
-        WHERE t.doctor_id = ?
-        ORDER BY t.start_date DESC, t.id DESC
-    ''', (did,)).fetchall()
-    
-    # Get all treatments and prescriptions for each patient
-    logs_with_details = []
-    for log in logs:
-        pid = log['patient_id']
-        # Get all treatments for this patient
-        treatments = conn.execute('SELECT * FROM treatments WHERE patient_id = ? ORDER BY start_date DESC', (pid,)).fetchall()
-        # Get all prescriptions for this patient with treatment_id
-        prescriptions = conn.execute('''
-            SELECT p.id, p.created_at, p.notes, p.treatment_id,
-                   GROUP_CONCAT(pi.medication_name, ', ') AS medications,
-                   GROUP_CONCAT(pi.dosage, ', ') AS dosages
-            FROM prescriptions p
-            LEFT JOIN prescription_items pi ON pi.prescription_id = p.id
-            WHERE p.patient_id = ?
-            GROUP BY p.id
-            ORDER BY p.created_at DESC
-        ''', (pid,)).fetchall()
-        
-        log_dict = dict(log)
-        log_dict['treatments'] = treatments
-        log_dict['prescriptions'] = prescriptions
-        logs_with_details.append(log_dict)
-    
-    conn.close()
-    return render_template('doctor_logs.html', logs=logs_with_details)
+    # serve the cached payload when nothing changed since it was built; only
+    # the first page (where every visit starts) is cached — cursor pages are
+    # keyed by request-supplied values and would accumulate forever
+    stamp = tuple(conn.execute(SQL_LOGS_STAMP, (did,)).fetchone())
+    first_page = after is None and after_id is None
+    if first_page:
+        cached = _logs_cache.get(did)
+        if cached is not None and cached[0] == stamp:
+            return render_template('doctor_logs.html', logs=cached[1],
+                                   after=after, has_next=cached[2])
+
+    # one aggregated query for every involved patient's prescriptions instead
+    # of two extra queries per log row (the old N+1 pattern), then bucket by
+    # patient in a single linear pass
+    presc_by_patient = {}
+    for p in conn.execute(SQL_PRESCRIPTIONS_FOR_DOCTOR_PATIENTS, (did,)):
+        presc_by_patient.setdefault(p['patient_id'], []).append(p)
+
+    if after is not None and after_id is not None:
+        logs = conn.execute(SQL_LOGS_PAGE_AFTER, (did, after, after_id, PAGE_SIZE + 1))
+    else:
+        logs = conn.execute(SQL_LOGS_PAGE, (did, PAGE_SIZE + 1))
+
+    # build only the keys the template renders instead of dict(log) copies
+    # that re-hash every treatment column per row
+    logs_with_details = [
+        {
+            'id': log['id'],
+            'patient_id': log['patient_id'],
+            'first_name': log['first_name'],
+            'last_name': log['last_name'],
+            'start_date': log['start_date'],
+            'description': log['description'],
+            'prescriptions': presc_by_patient.get(log['patient_id'], []),
+        }
+        for log in logs
+    ]
+    has_next = len(logs_with_details) > PAGE_SIZE
+    if has_next:
+        logs_with_details = logs_with_details[:PAGE_SIZE]
+
+    if first_page:
+        _logs_cache[did] = (stamp, logs_with_details, has_next)
+    return render_template('doctor_logs.html', logs=logs_with_details,
+                           after=after, has_next=has_next)
 
 
 @doctor_bp.route('/add_treatment', methods=['GET', 'POST'])
 def add_treatment():
-    from flask import session, redirect, flash
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
@@ -109,55 +298,59 @@ def add_treatment():
         else:
             did = None
         # if doctor is logged in via session, use that id
-        from flask import session
         if session.get('doctor_logged_in') and session.get('doctor_id'):
             did = session.get('doctor_id')
 
         details = request.form['details']
         conn.execute("INSERT INTO treatments (patient_id, doctor_id, description) VALUES (?, ?, ?)", (pid, did, details))
         conn.commit()
-        conn.close()
+        _drop_cached(_profile_cache, did)
         return redirect(url_for('doctor.view_logs'))
 
     # GET: render simple form with patients assigned to this doctor
-    patients = conn.execute('''
-        SELECT DISTINCT p.id, p.first_name, p.last_name
-        FROM patients p
-        LEFT JOIN appointments a ON a.patient_id = p.id
-        WHERE p.doctor = ? OR a.doctor_id = ?
-        ORDER BY p.first_name, p.last_name
-    ''', (did, did)).fetchall()
+    patients = conn.execute(SQL_DOCTOR_PATIENTS_BRIEF, (did, did)).fetchall()
     doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
-    conn.close()
     return render_template('add_treatment.html', patients=patients, doctors=doctors)
 
 
 @doctor_bp.route('/login', methods=['GET', 'POST'])
 def login():
-    from flask import session, flash
     conn = get_conn()
     if request.method == 'POST':
         username = request.form.get('username','').strip()
         password = request.form.get('password','')
-        # username is f_name + l_name (no space)
-        # try to find matching doctor
-        row = conn.execute("SELECT * FROM doctors WHERE (f_name || l_name) = ? AND password = ?", (username, password)).fetchone()
-        if row:
+        # indexed lookup on the stored username (backfilled from
+        # f_name || l_name); fall back to the computed-name scan only for
+        # rows the migration hasn't touched yet
+        row = conn.execute('SELECT doctor_id, f_name, l_name, password FROM doctors WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            row = conn.execute('SELECT doctor_id, f_name, l_name, password FROM doctors WHERE (f_name || l_name) = ?', (username,)).fetchone()
+        ok = False
+        if row and row['password']:
+            stored = row['password']
+            if stored.startswith(('pbkdf2:', 'scrypt:')):
+                ok = check_password_hash(stored, password)
+            else:
+                # legacy plaintext row: constant-time compare, then upgrade
+                # the stored value to a hash on successful login
+                ok = hmac.compare_digest(stored, password)
+                if ok:
+                    conn.execute('UPDATE doctors SET password = ? WHERE doctor_id = ?',
+                                 (generate_password_hash(password), row['doctor_id']))
+                    conn.commit()
+        if ok:
             session['doctor_logged_in'] = True
             session['doctor_id'] = row['doctor_id']
             session['doctor_name'] = f"{row['f_name']} {row['l_name']}"
-            conn.close()
             # after login, go to Manage Patients so the doctor can pick a patient
             return redirect(url_for('doctor.my_patients'))
         else:
             flash('Invalid doctor credentials')
-    conn.close()
     return render_template('doctor_login.html')
 
 
 @doctor_bp.route('/logout')
 def logout():
-    from flask import session
     session.pop('doctor_logged_in', None)
     session.pop('doctor_id', None)
     session.pop('doctor_name', None)
@@ -167,44 +360,70 @@ def logout():
 
 @doctor_bp.route('/treatment/edit/<int:tid>', methods=['GET', 'POST'])
 def edit_treatment(tid):
-    from flask import session, flash
+    if not session.get('doctor_logged_in'):
+        flash('Not authorized to edit this treatment')
+        return redirect(url_for('doctor.view_logs'))
+    did = session.get('doctor_id')
     conn = get_conn()
-    treatment = conn.execute('SELECT t.*, p.first_name || " " || p.last_name AS patient_name FROM treatments t LEFT JOIN patients p ON p.id = t.patient_id WHERE t.id = ?', (tid,)).fetchone()
+    # authorization folded into the WHERE clause: a treatment that isn't this
+    # doctor's simply returns no row, and the index stops the search early
+    treatment = conn.execute('SELECT id, patient_id, description, first_name, last_name FROM v_treatments_with_patient WHERE id = ? AND doctor_id = ?', (tid, did)).fetchone()
     if not treatment:
-        conn.close()
-        flash('Treatment not found')
-        return redirect(url_for('doctor.view_logs'))
-
-    # Only the assigned doctor (or if not logged in, prevent edit)
-    if not session.get('doctor_logged_in') or session.get('doctor_id') != treatment['doctor_id']:
-        conn.close()
-        flash('Not authorized to edit this treatment')
+        flash('Treatment not found or not authorized')
         return redirect(url_for('doctor.view_logs'))
 
     if request.method == 'POST':
         desc = request.form.get('description')
-        conn.execute('UPDATE treatments SET description = ? WHERE id = ?', (desc, tid))
+        conn.execute('UPDATE treatments SET description = ? WHERE id = ? AND doctor_id = ?', (desc, tid, did))
         conn.commit()
-        conn.close()
+        # description edits don't move the logs stamp, so drop the cache entries
+        _logs_cache.pop(did, None)
+        _drop_cached(_profile_cache, did)
         flash('Treatment updated')
         return redirect(url_for('doctor.view_logs'))
 
-    conn.close()
     return render_template('edit_treatment.html', treatment=treatment)
 
 
 @doctor_bp.route('/doctors')
 def list_doctors():
     conn = get_conn()
-    doctors = conn.execute('SELECT * FROM doctors ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return render_template('doctors.html', doctors=doctors)
+    try:
+        etag = conn.execute(SQL_ROSTER_STAMP).fetchone()[0]
+    except sqlite3.OperationalError:
+        etag = None  # pre-v10 DB without updated_at
+    # a client revisiting with a matching validator skips the roster query
+    # and the render entirely
+    if etag is not None and request.if_none_match.contains(etag):
+        return '', 304
+    now = time.monotonic()
+    stale = (_roster_cache['rows'] is None
+             or (etag is not None and _roster_cache['etag'] != etag)
+             or (etag is None and now - _roster_cache['at'] > _ROSTER_TTL))
+    if stale:
+        _roster_cache['rows'] = conn.execute('SELECT doctor_id, f_name, l_name, specialization, contact, department, availability FROM doctors ORDER BY created_at DESC').fetchall()
+        _roster_cache['at'] = now
+        _roster_cache['etag'] = etag
+    # page by slicing the cached roster: one fetch serves every page
+    page = _page_arg()
+    rows = _roster_cache['rows']
+    start = (page - 1) * PAGE_SIZE
+    resp = make_response(render_template('doctors.html', doctors=rows[start:start + PAGE_SIZE],
+                                         page=page, has_next=len(rows) > start + PAGE_SIZE))
+    if etag is not None:
+        resp.set_etag(etag)
+    return resp
 
 
 @doctor_bp.route('/profile/<int:did>')
 def doctor_profile(did):
+    page = _page_arg()
+    cached = _profile_cache.get((did, page))
+    if cached is not None and time.monotonic() < cached[0]:
+        doc, treatments, has_next = cached[1]
+        return _profile_response(doc, treatments, page, has_next)
     conn = get_conn()
-    doc = conn.execute('SELECT * FROM doctors WHERE doctor_id = ?', (did,)).fetchone()
+    doc = conn.execute('SELECT doctor_id, f_name, l_name, specialization, contact, department, availability FROM doctors WHERE doctor_id = ?', (did,)).fetchone()
     treatments = conn.execute('''
         SELECT COALESCE(t.id, 0) as id, 
                a.patient_id, 
@@ -216,97 +435,108 @@ def doctor_profile(did):
         LEFT JOIN treatments t ON t.patient_id = a.patient_id AND t.doctor_id = a.doctor_id
         WHERE a.doctor_id = ? AND a.status IN ('confirmed', 'completed')
         ORDER BY a.appointment_datetime DESC
-    ''', (did,)).fetchall()
-    
-    conn.close()
-    return render_template('doctor_profile.html', doctor=doc, treatments=treatments)
+        LIMIT ? OFFSET ?
+    ''', (did, PAGE_SIZE + 1, (page - 1) * PAGE_SIZE)).fetchall()
+    has_next = len(treatments) > PAGE_SIZE
+    if has_next:
+        treatments = treatments[:PAGE_SIZE]
+
+    _profile_cache[(did, page)] = (time.monotonic() + _PROFILE_TTL, (doc, treatments, has_next))
+    return _profile_response(doc, treatments, page, has_next)
+
+
+def _profile_response(doc, treatments, page, has_next):
+    # content-hash ETag: profile data has no single cheap stamp (treatment
+    # descriptions can change without moving any id/count), so hash the
+    # rendered bytes and let make_conditional turn a match into a 304 —
+    # the transfer is skipped even when the render isn't
+    resp = make_response(render_template('doctor_profile.html', doctor=doc,
+                                         treatments=treatments, page=page,
+                                         has_next=has_next))
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 
 @doctor_bp.route('/patients')
 def my_patients():
     # show patients assigned to logged-in doctor
-    from flask import session, redirect, flash
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
+    page = _page_arg()
     conn = get_conn()
-    patients = conn.execute('''
-        SELECT DISTINCT p.id, p.first_name, p.last_name, p.dob, p.phone
-        FROM patients p
-        LEFT JOIN appointments a ON a.patient_id = p.id
-        WHERE p.doctor = ? OR a.doctor_id = ?
-        ORDER BY p.first_name, p.last_name
-    ''', (did, did)).fetchall()
-    conn.close()
-    return render_template('doctor_patients.html', patients=patients)
+    patients = conn.execute(SQL_DOCTOR_PATIENTS_FULL_PAGE,
+                            (did, did, PAGE_SIZE + 1, (page - 1) * PAGE_SIZE)).fetchall()
+    has_next = len(patients) > PAGE_SIZE
+    if has_next:
+        patients = patients[:PAGE_SIZE]
+    return render_template('doctor_patients.html', patients=patients,
+                           page=page, has_next=has_next)
 
 
 @doctor_bp.route('/dashboard')
 def dashboard():
     """Doctor dashboard: show today's schedule (appointments for the day)."""
-    from flask import session, flash
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
     conn = get_conn()
+    # bulk rows go straight to the template: cheap tuple rows, not Row objects
+    cur = conn.cursor()
+    cur.row_factory = _nt_factory
     # select appointments for today for this doctor
-    rows = conn.execute('''
-        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
-        FROM appointments a
-        LEFT JOIN patients p ON p.id = a.patient_id
-        WHERE a.doctor_id = ? AND date(a.appointment_datetime) = date('now') AND a.status IN ('booked','confirmed')
-        ORDER BY a.appointment_datetime ASC
+    rows = cur.execute('''
+        SELECT id, appointment_datetime, status, first_name, last_name
+        FROM v_appointments_with_patient
+        WHERE doctor_id = ?
+          AND appointment_datetime >= date('now')
+          AND appointment_datetime < date('now', '+1 day')
+          AND status IN ('booked','confirmed')
+        ORDER BY appointment_datetime ASC
     ''', (did,)).fetchall()
-    conn.close()
     return render_template('doctor_dashboard.html', rows=rows)
 
 
 @doctor_bp.route('/appointments')
 def view_appointments_doctor():
     """Show appointments assigned to the logged-in doctor that are confirmed."""
-    from flask import session, redirect, flash
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
     conn = get_conn()
-    rows = conn.execute('''
-        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
-        FROM appointments a
-        LEFT JOIN patients p ON p.id = a.patient_id
-        WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
-        ORDER BY a.appointment_datetime ASC
+    # bulk rows go straight to the template: cheap tuple rows, not Row objects
+    cur = conn.cursor()
+    cur.row_factory = _nt_factory
+    rows = cur.execute('''
+        SELECT id, appointment_datetime, status, notes, first_name, last_name
+        FROM v_appointments_with_patient
+        WHERE doctor_id = ? AND status IN ('booked','confirmed')
+        ORDER BY appointment_datetime ASC
     ''', (did,)).fetchall()
-    conn.close()
     return render_template('doctor_appointments.html', rows=rows)
 
 
 @doctor_bp.route('/appointment/<int:aid>', methods=['GET', 'POST'])
 def open_appointment(aid):
     """Open a single appointment so the assigned doctor can add treatment notes."""
-    from flask import session, flash
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
     conn = get_conn()
+    # assignment check lives in the WHERE clause: an appointment belonging to
+    # another doctor yields no row instead of a Python-side comparison
     appt = conn.execute('''
-        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name, p.id AS patient_id
-        FROM appointments a
-        JOIN patients p ON p.id = a.patient_id
-        WHERE a.id = ?
-    ''', (aid,)).fetchone()
+        SELECT id, patient_id, appointment_datetime, status, notes,
+               first_name, last_name
+        FROM v_appointments_with_patient
+        WHERE id = ? AND doctor_id = ?
+    ''', (aid, did)).fetchone()
     if not appt:
-        conn.close()
-        flash('Appointment not found')
-        return redirect(url_for('doctor.view_appointments_doctor'))
-
-    # ensure this appointment is assigned to this doctor
-    if appt['doctor_id'] is None or appt['doctor_id'] != did:
-        conn.close()
-        flash('Not authorized to view this appointment')
+        flash('Appointment not found or not assigned to you')
         return redirect(url_for('doctor.view_appointments_doctor'))
 
     # handle adding a treatment note
@@ -314,43 +544,29 @@ def open_appointment(aid):
         details = request.form.get('details') or ''
         conn.execute('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (appt['patient_id'], did, details))
         conn.commit()
+        _drop_cached(_profile_cache, did)
         flash('Treatment note added')
 
     # reload treatments for the patient
-    treatments = conn.execute('SELECT * FROM treatments WHERE patient_id = ? ORDER BY start_date DESC', (appt['patient_id'],)).fetchall()
-    conn.close()
+    treatments = conn.execute(SQL_TREATMENTS_BY_PATIENT, (appt['patient_id'],)).fetchall()
     return render_template('doctor_appointment.html', appointment=appt, treatments=treatments)
 
 
 @doctor_bp.route('/patient/<int:pid>', methods=['GET', 'POST'])
 def view_patient(pid):
     # doctor can add symptoms (as treatment), prescribe (prescription + items)
-    from flask import session, flash
     if not session.get('doctor_logged_in'):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
-    ensure_bidirectional_links()
     did = session.get('doctor_id')
     conn = get_conn()
-    patient = conn.execute('SELECT * FROM patients WHERE id = ?', (pid,)).fetchone()
+    # patient fetch and access check (primary doctor, or an appointment
+    # assigned to this doctor) share one statement
+    patient = conn.execute(SQL_PATIENT_WITH_ACCESS, (did, did, pid)).fetchone()
     if not patient:
-        conn.close()
         flash('Patient not found')
         return redirect(url_for('doctor.my_patients'))
-
-    # ensure this patient is accessible to this doctor: either primary doctor or has an appointment assigned to this doctor
-    accessible = False
-    try:
-        if patient['doctor'] == did:
-            accessible = True
-    except Exception:
-        accessible = False
-    if not accessible:
-        row = conn.execute('SELECT COUNT(1) AS cnt FROM appointments WHERE patient_id = ? AND doctor_id = ?', (pid, did)).fetchone()
-        if row and row['cnt'] > 0:
-            accessible = True
-    if not accessible:
-        conn.close()
+    if not patient['accessible']:
         flash('Not authorized to view this patient')
         return redirect(url_for('doctor.my_patients'))
 
@@ -361,54 +577,67 @@ def view_patient(pid):
             desc = request.form.get('description')
             conn.execute('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (pid, did, desc))
             conn.commit()
+            _drop_cached(_profile_cache, did)
             flash('Symptom / treatment note added')
         elif action == 'prescribe':
-            # First create the treatment
             description = request.form.get('description') or ''
-            cur_treatment = conn.execute('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (pid, did, description))
-            treatment_id = cur_treatment.lastrowid
-            
-            # Now create the prescription linked to the treatment
-            med_name = request.form.get('medication_name')
-            dosage = request.form.get('dosage')
             duration = request.form.get('duration') or ''
-            unit_price = float(request.form.get('unit_price') or 0)
-            med_description = request.form.get('medication_description') or ''
 
-            # create prescription with duration in notes and link to treatment
+            # the form may submit several medication rows (repeated field
+            # names); parse them all before taking the write lock. A single-
+            # row form is just the one-element case.
+            med_names = request.form.getlist('medication_name')
+            dosages = request.form.getlist('dosage')
+            med_descriptions = request.form.getlist('medication_description')
+            unit_prices = request.form.getlist('unit_price')
+            items = []
+            for i, med_name in enumerate(med_names):
+                if not med_name:
+                    continue
+                try:
+                    price = float(unit_prices[i]) if i < len(unit_prices) and unit_prices[i] else 0.0
+                except ValueError:
+                    price = 0.0
+                items.append((med_name,
+                              med_descriptions[i] if i < len(med_descriptions) else '',
+                              dosages[i] if i < len(dosages) else '',
+                              1, price))
+
+            # prescription notes carry the duration alongside free-form notes
             notes = request.form.get('notes') or ''
             if duration:
                 notes = f"Duration: {duration}" + (f" | {notes}" if notes else "")
-            cur = conn.execute('INSERT INTO prescriptions (patient_id, doctor_id, notes, treatment_id) VALUES (?, ?, ?, ?)', (pid, did, notes, treatment_id))
-            presc_id = cur.lastrowid
-            # add item with medication info directly in prescription_items (no medications table)
-            conn.execute('INSERT INTO prescription_items (prescription_id, medication_name, medication_description, dosage, quantity, unit_price) VALUES (?, ?, ?, ?, ?, ?)', (presc_id, med_name, med_description, dosage, 1, unit_price))
-            
-            # Update treatment with prescription_id for bidirectional link
+
+            # one write transaction for the whole action (single lock grab and
+            # fsync instead of per-statement); RETURNING hands the new ids
+            # back without a lastrowid round-trip
+            conn.execute('BEGIN IMMEDIATE')
+            treatment_id = conn.execute('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now")) RETURNING id', (pid, did, description)).fetchone()[0]
+            presc_id = conn.execute('INSERT INTO prescriptions (patient_id, doctor_id, notes, treatment_id) VALUES (?, ?, ?, ?) RETURNING id', (pid, did, notes, treatment_id)).fetchone()[0]
+            # medication info lives directly on prescription_items (no
+            # medications table); executemany lands every row of a multi-drug
+            # prescription in one call instead of one execute per item
+            conn.executemany('INSERT INTO prescription_items (prescription_id, medication_name, medication_description, dosage, quantity, unit_price) VALUES (?, ?, ?, ?, ?, ?)',
+                             [(presc_id,) + item for item in items])
+            # bidirectional link back to the treatment
             conn.execute('UPDATE treatments SET prescription_id = ? WHERE id = ?', (presc_id, treatment_id))
-            
             conn.commit()
+            _drop_cached(_profile_cache, did)
             flash('Treatment and prescription created')
 
-    treatments = conn.execute('SELECT * FROM treatments WHERE patient_id = ? ORDER BY start_date DESC', (pid,)).fetchall()
-    prescriptions = conn.execute('''
-        SELECT p.id, p.created_at, p.notes, p.treatment_id,
-               GROUP_CONCAT(pi.medication_name, ', ') AS medications,
-               GROUP_CONCAT(pi.dosage, ', ') AS dosages
-        FROM prescriptions p
-        LEFT JOIN prescription_items pi ON pi.prescription_id = p.id
-        WHERE p.patient_id = ?
-        GROUP BY p.id
-        ORDER BY p.created_at DESC
-    ''', (pid,)).fetchall()
-    
-    # Fetch appointment notes (reason for booking) for this patient and doctor
-    appointments = conn.execute('''
-        SELECT appointment_datetime, notes, status
-        FROM appointments
-        WHERE patient_id = ? AND doctor_id = ?
-        ORDER BY appointment_datetime DESC
-    ''', (pid, did)).fetchall()
-    
-    conn.close()
+    # one fused query for all three page sections, partitioned by the kind
+    # tag: a single statement prepare and VDBE run instead of three
+    treatments, prescriptions, appointments = [], [], []
+    for row in conn.execute(SQL_PATIENT_SECTIONS, (pid, pid, pid, did)):
+        kind = row['kind']
+        if kind == 't':
+            treatments.append({'id': row['c1'], 'description': row['c2'],
+                               'start_date': row['c3'], 'end_date': row['c4']})
+        elif kind == 'p':
+            prescriptions.append({'treatment_id': row['c1'], 'notes': row['c2'],
+                                  'medications': row['c3'], 'dosages': row['c4']})
+        else:
+            # appointment notes double as the booking reason
+            appointments.append({'appointment_datetime': row['c3'], 'notes': row['c2']})
+
     return render_template('doctor_patient.html', patient=patient, treatments=treatments, prescriptions=prescriptions, appointments=appointments)
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-import sqlite3
 import os
+import db
 
 patient_bp = Blueprint('patient', __name__)
 
@@ -8,14 +8,10 @@ patient_bp = Blueprint('patient', __name__)
 DATABASE = os.path.join(os.path.dirname(__file__), 'hospital_management.db')
 
 def get_db():
-    # increase timeout and allow connections from different threads
-    conn = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        conn.execute('PRAGMA foreign_keys = ON;')
-    except Exception:
-        pass
-    return conn
+    # request-scoped connection shared with the other blueprints (see db.py);
+    # the app teardown closes it, so handlers no longer pay the per-call
+    # connect/close and PRAGMA setup cost
+    return db.get_db()
 
 
 @patient_bp.route('/login', methods=['GET', 'POST'])
@@ -29,7 +25,6 @@ def login():
 
         conn = get_db()
         patient = conn.execute('SELECT id, first_name, last_name FROM patients WHERE id = ?', (pid,)).fetchone()
-        conn.close()
         if patient:
             session['patient_id'] = patient['id']
             session['patient_name'] = f"{patient['first_name']} {patient['last_name']}"
@@ -74,12 +69,10 @@ def book_appointment():
 
         conn.execute('INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, notes) VALUES (?, ?, ?, ?)', (session['patient_id'], doctor_id, appt_dt, notes))
         conn.commit()
-        conn.close()
         flash('Appointment booked successfully and is pending admin approval', 'success')
         return redirect(url_for('patient.view_appointments'))
 
     # GET: show booking form (no doctor selection)
-    conn.close()
     return render_template('patient_book.html')
 
 
@@ -89,7 +82,6 @@ def view_appointments():
         return redirect(url_for('patient.login'))
     conn = get_db()
     rows = conn.execute('SELECT a.*, d.f_name || " " || d.l_name AS doctor_name FROM appointments a LEFT JOIN doctors d ON d.doctor_id = a.doctor_id WHERE a.patient_id = ? ORDER BY a.appointment_datetime DESC', (session['patient_id'],)).fetchall()
-    conn.close()
     return render_template('patient_appointments.html', rows=rows)
 
 
@@ -100,18 +92,15 @@ def cancel_appointment(aid):
     conn = get_db()
     appt = conn.execute('SELECT * FROM appointments WHERE id = ?', (aid,)).fetchone()
     if not appt:
-        conn.close()
         flash('Appointment not found', 'danger')
         return redirect(url_for('patient.view_appointments'))
 
     # ensure the logged-in patient owns this appointment
     if appt['patient_id'] != session['patient_id']:
-        conn.close()
         flash('Not authorized to cancel this appointment', 'danger')
         return redirect(url_for('patient.view_appointments'))
 
     conn.execute("UPDATE appointments SET status = 'cancelled' WHERE id = ?", (aid,))
     conn.commit()
-    conn.close()
     flash('Appointment cancelled', 'success')
     return redirect(url_for('patient.view_appointments'))